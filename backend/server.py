@@ -1,17 +1,34 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse, Response, JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, ReplaceOne, UpdateOne, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, DuplicateKeyError
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import Callable, List, Optional, Tuple
 from datetime import datetime, timezone, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import os
 import logging
 import uuid
+import json
+import re
+import glob
+import base64
+import asyncio
+import time
+import functools
+import multiprocessing
+import hashlib
+import tempfile
+import zipfile
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import stripe
 from pathlib import Path
 from io import BytesIO
@@ -21,6 +38,7 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from reportlab.pdfgen import canvas
+from PIL import Image as PILImage, ImageOps
 import requests
 
 ROOT_DIR = Path(__file__).parent
@@ -28,7 +46,7 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # JWT Configuration
@@ -39,8 +57,46 @@ JWT_EXPIRATION_HOURS = int(os.environ.get('JWT_EXPIRATION_HOURS', 24))
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Invoice numbering: INV-1001, or INV-2026-0001 when numbered per year
+INVOICE_NUMBER_PREFIX = os.environ.get('INVOICE_NUMBER_PREFIX', 'INV')
+INVOICE_NUMBER_PER_YEAR = os.environ.get('INVOICE_NUMBER_PER_YEAR', 'false').lower() == 'true'
+INVOICE_NUMBER_START = int(os.environ.get('INVOICE_NUMBER_START', 1001))
+
+# Worker pool for bcrypt hashing and verification
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+
+# Process pool for invoice PDF rendering
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', 2))
+PDF_QUEUE_LIMIT = int(os.environ.get('PDF_QUEUE_LIMIT', 16))
+PDF_RETRY_AFTER_SECONDS = int(os.environ.get('PDF_RETRY_AFTER_SECONDS', 5))
+
+# Rendered invoice PDF cache (memory LRU plus optional disk tier)
+PDF_CACHE_MAX_ENTRIES = int(os.environ.get('PDF_CACHE_MAX_ENTRIES', 128))
+PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR')
+
+# Background thumbnail generation for image deliverables
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+THUMBNAIL_QUEUE_LIMIT = int(os.environ.get('THUMBNAIL_QUEUE_LIMIT', 64))
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 320))
+
+# Authenticated user cache
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 1024))
+
 # Stripe Configuration
 stripe.api_key = os.environ['STRIPE_SECRET_KEY']
+# Point at a local fake (e.g. stripe-mock on http://localhost:12111) for load tests
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')
+if STRIPE_API_BASE:
+    stripe.api_base = STRIPE_API_BASE
+STRIPE_TIMEOUT_SECONDS = float(os.environ.get('STRIPE_TIMEOUT_SECONDS', 10))
+STRIPE_MAX_RETRIES = int(os.environ.get('STRIPE_MAX_RETRIES', 2))
+STRIPE_RETRY_BACKOFF_SECONDS = float(os.environ.get('STRIPE_RETRY_BACKOFF_SECONDS', 0.5))
+STRIPE_WORKERS = int(os.environ.get('STRIPE_WORKERS', 8))
+# Each worker thread keeps its own pooled requests session
+stripe.default_http_client = stripe.RequestsClient(timeout=STRIPE_TIMEOUT_SECONDS)
+# Retries are handled by StripeGateway so they never block a worker thread
+stripe.max_network_retries = 0
 
 # Security
 security = HTTPBearer()
@@ -48,6 +104,9 @@ security = HTTPBearer()
 # Create the main app without a prefix
 app = FastAPI()
 
+# List query engine: "find" (skip/limit + batched joins) or "aggregate" (indexed $match/$sort + $lookup)
+LIST_QUERY_ENGINE = os.environ.get('LIST_QUERY_ENGINE', 'find')
+
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
@@ -60,6 +119,7 @@ class User(BaseModel):
     email: EmailStr
     name: str
     role: str = "admin"
+    version: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class UserCreate(BaseModel):
@@ -71,6 +131,7 @@ class UserUpdate(BaseModel):
     email: Optional[EmailStr] = None
     name: Optional[str] = None
     role: Optional[str] = None
+    version: Optional[int] = None  # when set, the update fails with 409 if the user changed meanwhile
 
 class GeneratePasswordResponse(BaseModel):
     password: str
@@ -93,6 +154,7 @@ class Client(BaseModel):
     company: Optional[str] = None
     phone: Optional[str] = None
     project_ids: List[str] = []
+    version: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -107,15 +169,19 @@ class ClientUpdate(BaseModel):
     email: Optional[EmailStr] = None
     company: Optional[str] = None
     phone: Optional[str] = None
+    version: Optional[int] = None
 
 class Deliverable(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    project_id: Optional[str] = None
     name: str
     filename: str
     file_path: str
     file_size: int
     file_type: str
+    sha256: Optional[str] = None
+    thumbnail_status: Optional[str] = None  # pending, ready, failed
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Project(BaseModel):
@@ -127,7 +193,7 @@ class Project(BaseModel):
     status: str = "active"  # active, completed, on-hold
     deadline: Optional[datetime] = None
     total_value: float = 0.0
-    deliverables: List[Deliverable] = []
+    version: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -144,6 +210,7 @@ class ProjectUpdate(BaseModel):
     status: Optional[str] = None
     deadline: Optional[datetime] = None
     total_value: Optional[float] = None
+    version: Optional[int] = None
 
 class InvoiceLineItem(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -174,6 +241,7 @@ class Invoice(BaseModel):
     stripe_payment_intent_id: Optional[str] = None
     stripe_checkout_session_id: Optional[str] = None
     payment_link: Optional[str] = None
+    version: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -196,6 +264,7 @@ class InvoiceUpdate(BaseModel):
     status: Optional[str] = None
     paid_at: Optional[datetime] = None
     stripe_payment_intent_id: Optional[str] = None
+    version: Optional[int] = None
 
 class Payment(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -238,19 +307,171 @@ class PaginationMeta(BaseModel):
     page: int
     page_size: int
     total_pages: int
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
 class PaginatedResponse(BaseModel):
     items: List
     meta: PaginationMeta
 
 
+# ==================== CACHE ====================
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after ttl seconds (never when ttl is None)"""
+    
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+    
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return None
+    
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+user_cache = TTLCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+
+
+# ==================== WORKER POOLS ====================
+
+# Every pool registers itself here so its load can be inspected
+worker_pools = {}
+
+class WorkerPoolSaturated(Exception):
+    """Raised when a worker pool's queue is full"""
+
+class WorkerPool:
+    """Runs blocking calls off the event loop on an executor, tracking in-flight and queued work"""
+    
+    def __init__(self, name: str, executor, max_workers: int, max_queue: Optional[int] = None):
+        self.name = name
+        self.executor = executor
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.rejected = 0
+        self.in_flight = 0
+        self.completed = 0
+        worker_pools[name] = self
+    
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.max_workers)
+    
+    async def run(self, fn, *args, **kwargs):
+        if self.max_queue is not None and self.in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise WorkerPoolSaturated(self.name)
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+    
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+password_pool = WorkerPool(
+    "password",
+    ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt"),
+    PASSWORD_HASH_WORKERS
+)
+
+
+# ==================== STRIPE GATEWAY ====================
+
+class StripeGateway:
+    """Async facade over the Stripe SDK: calls run on a worker pool with timeouts and retries"""
+    
+    RETRYABLE_ERRORS = (stripe.APIConnectionError, stripe.RateLimitError, asyncio.TimeoutError)
+    
+    def __init__(self, pool: WorkerPool, timeout: float, max_retries: int, backoff: float):
+        self.pool = pool
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+    
+    async def call(self, fn, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await asyncio.wait_for(self.pool.run(fn, *args, **kwargs), self.timeout)
+            except self.RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logger.warning(f"Stripe call {fn.__qualname__} failed ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
+    async def create_checkout_session(self, **params):
+        # A stable idempotency key makes retried creates safe
+        return await self.call(stripe.checkout.Session.create, idempotency_key=str(uuid.uuid4()), **params)
+    
+    async def retrieve_checkout_session(self, session_id: str):
+        return await self.call(stripe.checkout.Session.retrieve, session_id)
+    
+    async def create_payment_intent(self, **params):
+        return await self.call(stripe.PaymentIntent.create, idempotency_key=str(uuid.uuid4()), **params)
+    
+    async def list_payment_intents(self, **params):
+        return await self.call(stripe.PaymentIntent.list, **params)
+
+stripe_gateway = StripeGateway(
+    WorkerPool("stripe", ThreadPoolExecutor(max_workers=STRIPE_WORKERS, thread_name_prefix="stripe"), STRIPE_WORKERS),
+    STRIPE_TIMEOUT_SECONDS,
+    STRIPE_MAX_RETRIES,
+    STRIPE_RETRY_BACKOFF_SECONDS
+)
+
+
 # ==================== AUTH HELPERS ====================
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await password_pool.run(pwd_context.hash, password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_pool.run(pwd_context.verify, plain_password, hashed_password)
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -259,8 +480,13 @@ def create_access_token(data: dict) -> str:
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+    return await resolve_user(credentials.credentials)
+
+async def resolve_user(token: Optional[str]) -> User:
+    """Load the user a JWT was issued to"""
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
@@ -268,14 +494,477 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     
-    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+    
+    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
     if user_doc is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     
-    if isinstance(user_doc['created_at'], str):
-        user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
+    decode_dates(user_doc)
+    
+    user = User(**user_doc)
+    user_cache.set(user_id, user)
+    return user
+
+
+# ==================== NAME LOADER ====================
+
+async def load_client_names(client_ids) -> dict:
+    """Resolve a set of client ids to names with a single $in query"""
+    ids = list({cid for cid in client_ids if cid})
+    if not ids:
+        return {}
+    clients = await db.clients.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "name": 1}).to_list(len(ids))
+    return {c['id']: c['name'] for c in clients}
+
+async def load_project_titles(project_ids) -> dict:
+    """Resolve a set of project ids to titles with a single $in query"""
+    ids = list({pid for pid in project_ids if pid})
+    if not ids:
+        return {}
+    projects = await db.projects.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "title": 1}).to_list(len(ids))
+    return {p['id']: p['title'] for p in projects}
+
+async def populate_names(docs: List[dict], projects: bool = False) -> List[dict]:
+    """Fill client_name (and project_title) on a page of documents, one query per collection"""
+    client_names = await load_client_names(d.get('client_id') for d in docs)
+    project_titles = await load_project_titles(d.get('project_id') for d in docs) if projects else {}
+    for doc in docs:
+        if doc.get('client_id') in client_names:
+            doc['client_name'] = client_names[doc['client_id']]
+        if projects and doc.get('project_id') in project_titles:
+            doc['project_title'] = project_titles[doc['project_id']]
+    return docs
+
+
+# ==================== DATES ====================
+
+# Date fields stored as native BSON dates, per collection
+STORED_DATE_FIELDS = {
+    "users": ["created_at"],
+    "clients": ["created_at", "updated_at"],
+    "projects": ["created_at", "updated_at", "deadline"],
+    "invoices": ["created_at", "updated_at", "issued_date", "due_date", "paid_at"],
+    "payments": ["created_at"],
+    "activity": ["timestamp"],
+    "deliverables": ["uploaded_at"],
+}
+
+DATE_FIELDS = {field for fields in STORED_DATE_FIELDS.values() for field in fields}
+
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 500))
+
+def parse_datetime(value):
+    """Turn a stored date (BSON date or legacy ISO string) into an aware UTC datetime"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def decode_dates(doc: dict) -> dict:
+    """Normalize every date field of a document"""
+    for field in DATE_FIELDS:
+        if doc.get(field) is not None:
+            doc[field] = parse_datetime(doc[field])
+    return doc
+
+async def migrate_string_dates(batch_size: int = MIGRATION_BATCH_SIZE):
+    """Convert legacy ISO-string dates to native BSON dates in batches, while the app keeps serving"""
+    for collection_name, fields in STORED_DATE_FIELDS.items():
+        collection = db[collection_name]
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        projection = {field: 1 for field in fields}
+        
+        converted = 0
+        last_id = None
+        while True:
+            batch_query = {**query, "_id": {"$gt": last_id}} if last_id else query
+            docs = await collection.find(batch_query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not docs:
+                break
+            last_id = docs[-1]['_id']
+            
+            updates = []
+            for doc in docs:
+                try:
+                    changes = {field: parse_datetime(doc[field]) for field in fields if isinstance(doc.get(field), str)}
+                except ValueError as e:
+                    logger.error(f"Cannot convert dates of {collection_name} {doc['_id']}: {e}")
+                    continue
+                updates.append(UpdateOne({"_id": doc['_id']}, {"$set": changes}))
+            
+            if updates:
+                await collection.bulk_write(updates, ordered=False)
+                converted += len(updates)
+            # Yield to request handlers between batches
+            await asyncio.sleep(0)
+        
+        if converted:
+            logger.info(f"Converted string dates to native dates on {converted} {collection_name} documents")
+
+async def migrate_embedded_deliverables(batch_size: int = MIGRATION_BATCH_SIZE):
+    """Move deliverables embedded in project documents into the deliverables collection"""
+    moved = 0
+    while True:
+        projects = await db.projects.find(
+            {"deliverables.0": {"$exists": True}},
+            {"_id": 1, "id": 1, "deliverables": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not projects:
+            break
+        
+        inserts = []
+        for project in projects:
+            for deliverable in project['deliverables']:
+                try:
+                    decode_dates(deliverable)
+                except ValueError:
+                    deliverable['uploaded_at'] = None
+                deliverable['project_id'] = project['id']
+                # Upsert by id so a migration interrupted half-way can simply rerun
+                inserts.append(UpdateOne({"id": deliverable['id']}, {"$setOnInsert": deliverable}, upsert=True))
+        if inserts:
+            await db.deliverables.bulk_write(inserts, ordered=False)
+        await db.projects.update_many(
+            {"_id": {"$in": [project['_id'] for project in projects]}},
+            {"$unset": {"deliverables": ""}}
+        )
+        moved += len(inserts)
+        await asyncio.sleep(0)
+    
+    if moved:
+        logger.info(f"Moved {moved} embedded deliverables into the deliverables collection")
+
+async def run_migrations():
+    """Online data migrations, run in the background after startup"""
+    await migrate_embedded_deliverables()
+    await migrate_string_dates()
+    # Rollups are derived from native dates, so they are built once those are in place
+    if await claim_rollup_rebuild():
+        await rebuild_metrics_rollups()
+
+async def claim_rollup_rebuild() -> bool:
+    """Let a single worker run the first rollup rebuild; a stale claim is taken over"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.metrics_rollups.find_one_and_update(
+            {
+                "_id": ROLLUP_COUNTS_ID,
+                "rebuilt_at": {"$exists": False},
+                "$or": [
+                    {"rebuild_started_at": {"$exists": False}},
+                    {"rebuild_started_at": {"$lt": now - timedelta(seconds=ROLLUP_REBUILD_LOCK_SECONDS)}}
+                ]
+            },
+            {"$set": {"rebuild_started_at": now}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The counts document exists and is already rebuilt or claimed
+        return False
+    return True
+
+
+# ==================== PARTIAL UPDATES ====================
+
+async def patch_document(
+    collection,
+    doc_id: str,
+    values: dict,
+    computed: Optional[dict] = None,
+    derive: Optional[Callable[[dict], None]] = None,
+    version: Optional[int] = None,
+    projection: Optional[dict] = None,
+    entity: str = "Document"
+) -> Tuple[dict, dict]:
+    """Apply a partial update in a single round trip and return the (previous, updated) documents.
+    
+    values are stored as-is, computed are aggregation expressions evaluated against the
+    current document; derive must apply the same computation to the updated copy, which is
+    built from the pre-image. When version is given the write only applies if it still
+    matches, otherwise 409 is raised.
+    """
+    query = {"id": doc_id}
+    if version is not None:
+        # Documents written before versioning have no version field
+        query['version'] = {"$in": [0, None]} if version == 0 else version
+    projection = projection or {"_id": 0}
+    
+    if values or computed:
+        changes = {field: {"$literal": value} for field, value in values.items()}
+        changes.update(computed or {})
+        changes['version'] = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+        previous = await collection.find_one_and_update(
+            query,
+            [{"$set": changes}],
+            projection=projection,
+            return_document=ReturnDocument.BEFORE
+        )
+    else:
+        previous = await collection.find_one(query, projection)
+    
+    if previous is None:
+        if version is not None and await collection.count_documents({"id": doc_id}, limit=1):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"{entity} was modified by someone else, reload and try again"
+            )
+        raise HTTPException(status_code=404, detail=f"{entity} not found")
+    if not (values or computed):
+        return previous, dict(previous)
+    
+    doc = {**previous, **values, "version": (previous.get('version') or 0) + 1}
+    if derive:
+        derive(doc)
+    await publish_change(collection.name, "update", doc, changed_fields(previous, doc))
+    return previous, doc
+
+
+# ==================== AGGREGATION LISTING ====================
+
+# (from collection, local field, output field, source field)
+CLIENT_NAME_LOOKUP = ("clients", "client_id", "client_name", "name")
+PROJECT_TITLE_LOOKUP = ("projects", "project_id", "project_title", "title")
+
+def use_aggregation(engine: Optional[str]) -> bool:
+    """Resolve the list query engine for a request, falling back to LIST_QUERY_ENGINE"""
+    engine = engine or LIST_QUERY_ENGINE
+    if engine not in ("find", "aggregate"):
+        raise HTTPException(status_code=400, detail="engine must be 'find' or 'aggregate'")
+    return engine == "aggregate"
+
+async def aggregate_page(collection, match: dict, sort, skip: int, limit: int, lookups=(), exclude=()):
+    """Fetch one page with its joins in a single aggregation; the leading $match/$sort run on the index"""
+    items_pipeline = [{"$match": match}, {"$sort": dict(sort)}, {"$skip": skip}, {"$limit": limit}]
+    hidden = ["_id", *exclude]
+    for from_collection, local_field, as_field, source_field in lookups:
+        joined = f"_{as_field}"
+        items_pipeline.append({"$lookup": {
+            "from": from_collection,
+            "localField": local_field,
+            "foreignField": "id",
+            "as": joined
+        }})
+        items_pipeline.append({"$addFields": {as_field: {"$arrayElemAt": [f"${joined}.{source_field}", 0]}}})
+        hidden.append(joined)
+    items_pipeline.append({"$project": {field: 0 for field in hidden}})
+    
+    # Joins run after $limit, so they only touch the rows of this page
+    return await collection.aggregate(items_pipeline).to_list(limit)
+
+
+# ==================== PAGINATION ====================
+
+# Stable listing order shared by offset and keyset pagination
+LIST_SORT = [("created_at", 1), ("id", 1)]
+
+def encode_cursor(doc: dict) -> str:
+    """Encode the (created_at, id) position of a document as an opaque cursor"""
+    created_at = doc.get('created_at')
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    payload = json.dumps({"c": created_at, "i": doc['id']})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Decode an opaque cursor back into its (created_at, id) position"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return parse_datetime(payload['c']), payload['i']
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_match(cursor: str, after: bool) -> dict:
+    """Filter for documents strictly after (or before) a cursor position in LIST_SORT order"""
+    created_at, doc_id = decode_cursor(cursor)
+    op = "$gt" if after else "$lt"
+    return {"$or": [
+        {"created_at": {op: created_at}},
+        {"created_at": created_at, "id": {op: doc_id}}
+    ]}
+
+async def fetch_page(
+    collection,
+    page: int,
+    page_size: int,
+    engine: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    lookups=(),
+    exclude=()
+):
+    """Load one page of a collection by offset (page) or by keyset (after/before cursor)"""
+    if after and before:
+        raise HTTPException(status_code=400, detail="Use either after or before, not both")
+    
+    cursor = after or before
+    match = keyset_match(cursor, after=bool(after)) if cursor else {}
+    sort = [(field, -direction) for field, direction in LIST_SORT] if before else LIST_SORT
+    skip = 0 if cursor else (page - 1) * page_size
+    # Fetch one extra row to know whether another page exists
+    limit = page_size + 1
+    
+    # The total covers the whole collection, so it comes from collection metadata
+    # rather than a scan; the page itself is driven by the created_at_id index
+    if use_aggregation(engine):
+        items, total = await asyncio.gather(
+            aggregate_page(collection, match, sort, skip, limit, lookups, exclude),
+            collection.estimated_document_count()
+        )
+    else:
+        total = await collection.estimated_document_count()
+        projection = {"_id": 0, **{field: 0 for field in exclude}}
+        items = await collection.find(match, projection).sort(sort).skip(skip).limit(limit).to_list(limit)
+        if lookups:
+            await populate_names(items, projects=PROJECT_TITLE_LOOKUP in lookups)
+    
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if before:
+        items.reverse()
+    
+    has_next = bool(before) or has_more
+    has_prev = has_more if before else bool(after) or page > 1
+    
+    meta = {
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": (total + page_size - 1) // page_size,
+        "next_cursor": encode_cursor(items[-1]) if items and has_next else None,
+        "prev_cursor": encode_cursor(items[0]) if items and has_prev else None
+    }
+    return items, meta
+
+
+# ==================== INDEXES ====================
+
+# Declarative index registry: every hot query shape, keyed by collection
+LIST_SORT_INDEX = IndexModel(LIST_SORT, name="created_at_id")
+
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        LIST_SORT_INDEX,
+    ],
+    "clients": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        LIST_SORT_INDEX,
+    ],
+    "projects": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING)], name="status"),
+        LIST_SORT_INDEX,
+    ],
+    "invoices": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("number", ASCENDING)], name="number_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("paid_at", ASCENDING)], name="status_paid_at"),
+        LIST_SORT_INDEX,
+    ],
+    "payments": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+        LIST_SORT_INDEX,
+    ],
+    "activity": [
+        IndexModel([("timestamp", DESCENDING)], name="timestamp_desc"),
+    ],
+    "deliverables": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("project_id", ASCENDING), ("uploaded_at", ASCENDING)], name="project_id_uploaded_at"),
+        IndexModel([("sha256", ASCENDING)], name="sha256"),
+    ],
+    "metrics_rollups": [
+        IndexModel([("kind", ASCENDING), ("granularity", ASCENDING), ("period", ASCENDING)], name="kind_granularity_period"),
+    ],
+}
+
+async def ensure_indexes():
+    """Create every registered index; safe to run on each startup"""
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection_name].create_indexes([index])
+            except OperationFailure as e:
+                logger.error(f"Failed to create index {index.document['name']} on {collection_name}: {e}")
+    
+    report = await index_report()
+    for collection_name, diff in report.items():
+        if diff['missing']:
+            logger.warning(f"Missing indexes on {collection_name}: {', '.join(diff['missing'])}")
+        if diff['extra']:
+            logger.warning(f"Unregistered indexes on {collection_name}: {', '.join(diff['extra'])}")
+    return report
+
+async def index_report() -> dict:
+    """Compare the registry with the indexes that exist in the database"""
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        expected = {index.document['name'] for index in indexes}
+        existing = set(await db[collection_name].index_information()) - {"_id_"}
+        report[collection_name] = {
+            "missing": sorted(expected - existing),
+            "extra": sorted(existing - expected)
+        }
+    return report
+
+
+# ==================== INVOICE NUMBERS ====================
+
+def invoice_counter_key(year: Optional[int] = None) -> str:
+    return f"invoice_number:{year}" if year else "invoice_number"
+
+def format_invoice_number(seq: int, year: Optional[int] = None) -> str:
+    if year:
+        return f"{INVOICE_NUMBER_PREFIX}-{year}-{seq:04d}"
+    return f"{INVOICE_NUMBER_PREFIX}-{seq}"
+
+async def allocate_invoice_numbers(count: int = 1) -> List[str]:
+    """Reserve a block of consecutive invoice numbers with one atomic $inc"""
+    year = datetime.now(timezone.utc).year if INVOICE_NUMBER_PER_YEAR else None
+    counter = await db.counters.find_one_and_update(
+        {"_id": invoice_counter_key(year)},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    last = counter['seq']
+    return [format_invoice_number(seq, year) for seq in range(last - count + 1, last + 1)]
+
+async def seed_invoice_counters():
+    """Bring the counters up to the highest number already issued; never moves them backwards"""
+    pipeline = [
+        {"$match": {"number": {"$regex": f"^{INVOICE_NUMBER_PREFIX}-"}}},
+        {"$project": {"parts": {"$split": ["$number", "-"]}}},
+        {"$group": {
+            # INV-2026-0001 is counted per year, INV-1001 globally
+            "_id": {"$cond": [{"$eq": [{"$size": "$parts"}, 3]}, {"$arrayElemAt": ["$parts", 1]}, None]},
+            "max": {"$max": {"$convert": {
+                "input": {"$arrayElemAt": ["$parts", -1]},
+                "to": "int",
+                "onError": None,
+                "onNull": None
+            }}}
+        }}
+    ]
+    highest = {invoice_counter_key(): INVOICE_NUMBER_START - 1}
+    async for group in db.invoices.aggregate(pipeline):
+        if group['max'] is None:
+            continue
+        try:
+            key = invoice_counter_key(int(group['_id'])) if group['_id'] else invoice_counter_key()
+        except ValueError:
+            continue
+        highest[key] = max(highest.get(key, 0), group['max'])
     
-    return User(**user_doc)
+    for key, seq in highest.items():
+        await db.counters.update_one({"_id": key}, {"$max": {"seq": seq}}, upsert=True)
 
 
 # ==================== SEED DATA ====================
@@ -290,8 +979,7 @@ async def seed_default_user():
             role="admin"
         )
         user_dict = user.model_dump()
-        user_dict['password_hash'] = hash_password("admin123")
-        user_dict['created_at'] = user_dict['created_at'].isoformat()
+        user_dict['password_hash'] = await hash_password("admin123")
         await db.users.insert_one(user_dict)
         logging.info("Default admin user created")
 
@@ -313,8 +1001,6 @@ async def seed_sample_data():
     for c_data in clients_data:
         client = Client(**c_data)
         client_dict = client.model_dump()
-        client_dict['created_at'] = client_dict['created_at'].isoformat()
-        client_dict['updated_at'] = client_dict['updated_at'].isoformat()
         await db.clients.insert_one(client_dict)
         clients.append(client)
     
@@ -330,10 +1016,6 @@ async def seed_sample_data():
     for p_data in projects_data:
         project = Project(**p_data)
         project_dict = project.model_dump()
-        project_dict['created_at'] = project_dict['created_at'].isoformat()
-        project_dict['updated_at'] = project_dict['updated_at'].isoformat()
-        if project_dict['deadline']:
-            project_dict['deadline'] = project_dict['deadline'].isoformat()
         await db.projects.insert_one(project_dict)
         projects.append(project)
     
@@ -345,18 +1027,11 @@ async def seed_sample_data():
         {"client_id": clients[2].id, "project_id": projects[3].id, "amount": 12500.0, "status": "overdue", "due_date": datetime.now(timezone.utc) - timedelta(days=2)},
     ]
     
-    invoice_counter = 1001
-    for i_data in invoices_data:
-        invoice = Invoice(**i_data, number=f"INV-{invoice_counter}")
+    invoice_numbers = await allocate_invoice_numbers(len(invoices_data))
+    for i_data, invoice_number in zip(invoices_data, invoice_numbers):
+        invoice = Invoice(**i_data, number=invoice_number)
         invoice_dict = invoice.model_dump()
-        invoice_dict['created_at'] = invoice_dict['created_at'].isoformat()
-        invoice_dict['updated_at'] = invoice_dict['updated_at'].isoformat()
-        invoice_dict['issued_date'] = invoice_dict['issued_date'].isoformat()
-        invoice_dict['due_date'] = invoice_dict['due_date'].isoformat()
-        if invoice_dict['paid_at']:
-            invoice_dict['paid_at'] = invoice_dict['paid_at'].isoformat()
         await db.invoices.insert_one(invoice_dict)
-        invoice_counter += 1
         
         # Create payment records for paid invoices
         if i_data['status'] == 'paid':
@@ -368,19 +1043,17 @@ async def seed_sample_data():
                 stripe_payment_intent_id=f"pi_test_{uuid.uuid4().hex[:16]}"
             )
             payment_dict = payment.model_dump()
-            payment_dict['created_at'] = payment_dict['created_at'].isoformat()
             await db.payments.insert_one(payment_dict)
     
     # Sample Activities
     activities = [
         Activity(type="client_added", entity_type="client", entity_id=clients[0].id, message=f"New client '{clients[0].name}' added"),
         Activity(type="project_created", entity_type="project", entity_id=projects[0].id, message=f"Project '{projects[0].title}' created"),
-        Activity(type="invoice_paid", entity_type="invoice", entity_id="inv-1", message=f"Invoice INV-1001 paid by {clients[0].name}"),
+        Activity(type="invoice_paid", entity_type="invoice", entity_id="inv-1", message=f"Invoice {invoice_numbers[0]} paid by {clients[0].name}"),
     ]
     
     for activity in activities:
         activity_dict = activity.model_dump()
-        activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
         await db.activity.insert_one(activity_dict)
     
     logging.info("Sample data seeded successfully")
@@ -388,8 +1061,13 @@ async def seed_sample_data():
 
 @app.on_event("startup")
 async def startup_event():
+    await ensure_indexes()
+    await seed_invoice_counters()
     await seed_default_user()
     await seed_sample_data()
+    asyncio.create_task(run_migrations())
+    event_bus.start()
+    asyncio.create_task(collect_orphan_blobs())
 
 
 # ==================== AUTH ROUTES ====================
@@ -400,11 +1078,10 @@ async def login(request: LoginRequest):
     if not user_doc:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
-    if not verify_password(request.password, user_doc['password_hash']):
+    if not await verify_password(request.password, user_doc['password_hash']):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
-    if isinstance(user_doc['created_at'], str):
-        user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
+    decode_dates(user_doc)
     
     user = User(**{k: v for k, v in user_doc.items() if k != 'password_hash'})
     access_token = create_access_token({"sub": user.id})
@@ -415,6 +1092,16 @@ async def login(request: LoginRequest):
 async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
+@api_router.get("/system/workers")
+async def get_worker_stats(current_user: User = Depends(get_current_user)):
+    """Concurrency and queue depth of every worker pool"""
+    return {name: pool.stats() for name, pool in worker_pools.items()}
+
+@api_router.get("/auth/cache-stats")
+async def get_user_cache_stats(current_user: User = Depends(get_current_user)):
+    """Hit/miss counters of the authenticated-user cache"""
+    return user_cache.stats()
+
 
 # ==================== USERS ROUTES ====================
 
@@ -422,28 +1109,20 @@ async def get_me(current_user: User = Depends(get_current_user)):
 async def get_users(
     current_user: User = Depends(get_current_user),
     page: int = 1,
-    page_size: int = 10
+    page_size: int = 10,
+    engine: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None
 ):
-    skip = (page - 1) * page_size
-    total = await db.users.count_documents({})
-    
-    users = await db.users.find({}, {"_id": 0}).skip(skip).limit(page_size).to_list(page_size)
+    users, meta = await fetch_page(db.users, page, page_size, engine=engine, after=after, before=before, exclude=['password_hash'])
     for user in users:
-        if isinstance(user['created_at'], str):
-            user['created_at'] = datetime.fromisoformat(user['created_at'])
+        decode_dates(user)
         # Remove password_hash from response
         user.pop('password_hash', None)
     
-    total_pages = (total + page_size - 1) // page_size
-    
     return {
         "items": users,
-        "meta": {
-            "total": total,
-            "page": page,
-            "page_size": page_size,
-            "total_pages": total_pages
-        }
+        "meta": meta
     }
 
 @api_router.get("/users/{user_id}", response_model=User)
@@ -451,8 +1130,7 @@ async def get_user(user_id: str, current_user: User = Depends(get_current_user))
     user = await db.users.find_one({"id": user_id}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    if isinstance(user['created_at'], str):
-        user['created_at'] = datetime.fromisoformat(user['created_at'])
+    decode_dates(user)
     return User(**{k: v for k, v in user.items() if k != 'password_hash'})
 
 @api_router.post("/users", response_model=User)
@@ -471,10 +1149,13 @@ async def create_user(user_data: UserCreate, current_user: User = Depends(get_cu
     # Create user
     user = User(**user_data.model_dump())
     user_dict = user.model_dump()
-    user_dict['password_hash'] = hash_password(random_password)
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
+    user_dict['password_hash'] = await hash_password(random_password)
     
-    await db.users.insert_one(user_dict)
+    # The email_unique index settles concurrent signups the pre-check cannot see
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Log activity
     activity = Activity(
@@ -484,27 +1165,27 @@ async def create_user(user_data: UserCreate, current_user: User = Depends(get_cu
         message=f"User {user.name} ({user.email}) created",
         actor=current_user.name
     )
-    activity_dict = activity.model_dump()
-    activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
-    await db.activity.insert_one(activity_dict)
+    await log_activity(activity)
     
     return user
 
 @api_router.patch("/users/{user_id}", response_model=User)
 async def update_user(user_id: str, update_data: UserUpdate, current_user: User = Depends(get_current_user)):
-    existing = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not existing:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
+    update_dict = {k: v for k, v in update_data.model_dump(exclude={'version'}).items() if v is not None}
+    try:
+        _, updated_user = await patch_document(
+            db.users, user_id, update_dict,
+            version=update_data.version,
+            projection={"_id": 0, "password_hash": 0},
+            entity="User"
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     if update_dict:
-        await db.users.update_one({"id": user_id}, {"$set": update_dict})
-    
-    updated_user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if isinstance(updated_user['created_at'], str):
-        updated_user['created_at'] = datetime.fromisoformat(updated_user['created_at'])
+        user_cache.invalidate(user_id)
+    decode_dates(updated_user)
     
-    return User(**{k: v for k, v in updated_user.items() if k != 'password_hash'})
+    return User(**updated_user)
 
 @api_router.delete("/users/{user_id}")
 async def delete_user(user_id: str, current_user: User = Depends(get_current_user)):
@@ -513,6 +1194,7 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_use
         raise HTTPException(status_code=400, detail="Cannot delete your own account")
     
     result = await db.users.delete_one({"id": user_id})
+    user_cache.invalidate(user_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully"}
@@ -531,11 +1213,12 @@ async def generate_password(user_id: str, current_user: User = Depends(get_curre
     new_password = ''.join(secrets.choice(alphabet) for _ in range(12))
     
     # Update password
-    password_hash = hash_password(new_password)
+    password_hash = await hash_password(new_password)
     await db.users.update_one(
         {"id": user_id},
         {"$set": {"password_hash": password_hash}}
     )
+    user_cache.invalidate(user_id)
     
     # Log activity
     activity = Activity(
@@ -545,9 +1228,7 @@ async def generate_password(user_id: str, current_user: User = Depends(get_curre
         message=f"Password generated for {user['name']} ({user['email']})",
         actor=current_user.name
     )
-    activity_dict = activity.model_dump()
-    activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
-    await db.activity.insert_one(activity_dict)
+    await log_activity(activity)
     
     return GeneratePasswordResponse(
         password=new_password,
@@ -561,28 +1242,18 @@ async def generate_password(user_id: str, current_user: User = Depends(get_curre
 async def get_clients(
     current_user: User = Depends(get_current_user),
     page: int = 1,
-    page_size: int = 10
+    page_size: int = 10,
+    engine: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None
 ):
-    skip = (page - 1) * page_size
-    total = await db.clients.count_documents({})
-    
-    clients = await db.clients.find({}, {"_id": 0}).skip(skip).limit(page_size).to_list(page_size)
+    clients, meta = await fetch_page(db.clients, page, page_size, engine=engine, after=after, before=before)
     for client in clients:
-        if isinstance(client['created_at'], str):
-            client['created_at'] = datetime.fromisoformat(client['created_at'])
-        if isinstance(client['updated_at'], str):
-            client['updated_at'] = datetime.fromisoformat(client['updated_at'])
-    
-    total_pages = (total + page_size - 1) // page_size
+        decode_dates(client)
     
     return {
         "items": clients,
-        "meta": {
-            "total": total,
-            "page": page,
-            "page_size": page_size,
-            "total_pages": total_pages
-        }
+        "meta": meta
     }
 
 @api_router.get("/clients/{client_id}", response_model=Client)
@@ -590,19 +1261,15 @@ async def get_client(client_id: str, current_user: User = Depends(get_current_us
     client = await db.clients.find_one({"id": client_id}, {"_id": 0})
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
-    if isinstance(client['created_at'], str):
-        client['created_at'] = datetime.fromisoformat(client['created_at'])
-    if isinstance(client['updated_at'], str):
-        client['updated_at'] = datetime.fromisoformat(client['updated_at'])
+    decode_dates(client)
     return Client(**client)
 
 @api_router.post("/clients", response_model=Client)
 async def create_client(client_data: ClientCreate, current_user: User = Depends(get_current_user)):
     client = Client(**client_data.model_dump())
     client_dict = client.model_dump()
-    client_dict['created_at'] = client_dict['created_at'].isoformat()
-    client_dict['updated_at'] = client_dict['updated_at'].isoformat()
     await db.clients.insert_one(client_dict)
+    await record_counts(total_clients=1)
     
     # Log activity
     activity = Activity(
@@ -612,28 +1279,17 @@ async def create_client(client_data: ClientCreate, current_user: User = Depends(
         message=f"New client '{client.name}' added",
         actor=current_user.name
     )
-    activity_dict = activity.model_dump()
-    activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
-    await db.activity.insert_one(activity_dict)
+    await log_activity(activity)
     
     return client
 
 @api_router.patch("/clients/{client_id}", response_model=Client)
 async def update_client(client_id: str, update_data: ClientUpdate, current_user: User = Depends(get_current_user)):
-    existing = await db.clients.find_one({"id": client_id}, {"_id": 0})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Client not found")
-    
-    update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
+    update_dict = {k: v for k, v in update_data.model_dump(exclude={'version'}).items() if v is not None}
     if update_dict:
-        update_dict['updated_at'] = datetime.now(timezone.utc).isoformat()
-        await db.clients.update_one({"id": client_id}, {"$set": update_dict})
-    
-    updated_client = await db.clients.find_one({"id": client_id}, {"_id": 0})
-    if isinstance(updated_client['created_at'], str):
-        updated_client['created_at'] = datetime.fromisoformat(updated_client['created_at'])
-    if isinstance(updated_client['updated_at'], str):
-        updated_client['updated_at'] = datetime.fromisoformat(updated_client['updated_at'])
+        update_dict['updated_at'] = datetime.now(timezone.utc)
+    _, updated_client = await patch_document(db.clients, client_id, update_dict, version=update_data.version, entity="Client")
+    decode_dates(updated_client)
     return Client(**updated_client)
 
 @api_router.delete("/clients/{client_id}")
@@ -641,6 +1297,7 @@ async def delete_client(client_id: str, current_user: User = Depends(get_current
     result = await db.clients.delete_one({"id": client_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Client not found")
+    await record_counts(total_clients=-1)
     return {"message": "Client deleted successfully"}
 
 
@@ -650,55 +1307,29 @@ async def delete_client(client_id: str, current_user: User = Depends(get_current
 async def get_projects(
     current_user: User = Depends(get_current_user),
     page: int = 1,
-    page_size: int = 10
+    page_size: int = 10,
+    engine: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None
 ):
-    skip = (page - 1) * page_size
-    total = await db.projects.count_documents({})
-    
-    projects = await db.projects.find({}, {"_id": 0}).skip(skip).limit(page_size).to_list(page_size)
+    projects, meta = await fetch_page(db.projects, page, page_size, engine=engine, after=after, before=before, lookups=[CLIENT_NAME_LOOKUP], exclude=['deliverables'])
     for project in projects:
-        if isinstance(project['created_at'], str):
-            project['created_at'] = datetime.fromisoformat(project['created_at'])
-        if isinstance(project['updated_at'], str):
-            project['updated_at'] = datetime.fromisoformat(project['updated_at'])
-        if project.get('deadline') and isinstance(project['deadline'], str):
-            project['deadline'] = datetime.fromisoformat(project['deadline'])
-        
-        # Populate client name
-        if project.get('client_id'):
-            client = await db.clients.find_one({"id": project['client_id']}, {"_id": 0, "name": 1})
-            if client:
-                project['client_name'] = client['name']
-    
-    total_pages = (total + page_size - 1) // page_size
+        decode_dates(project)
     
     return {
         "items": projects,
-        "meta": {
-            "total": total,
-            "page": page,
-            "page_size": page_size,
-            "total_pages": total_pages
-        }
+        "meta": meta
     }
 
 @api_router.get("/projects/{project_id}", response_model=Project)
 async def get_project(project_id: str, current_user: User = Depends(get_current_user)):
-    project = await db.projects.find_one({"id": project_id}, {"_id": 0})
+    project = await db.projects.find_one({"id": project_id}, {"_id": 0, "deliverables": 0})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-    if isinstance(project['created_at'], str):
-        project['created_at'] = datetime.fromisoformat(project['created_at'])
-    if isinstance(project['updated_at'], str):
-        project['updated_at'] = datetime.fromisoformat(project['updated_at'])
-    if project.get('deadline') and isinstance(project['deadline'], str):
-        project['deadline'] = datetime.fromisoformat(project['deadline'])
+    decode_dates(project)
     
     # Populate client name
-    if project.get('client_id'):
-        client = await db.clients.find_one({"id": project['client_id']}, {"_id": 0, "name": 1})
-        if client:
-            project['client_name'] = client['name']
+    await populate_names([project])
     
     return Project(**project)
 
@@ -706,11 +1337,8 @@ async def get_project(project_id: str, current_user: User = Depends(get_current_
 async def create_project(project_data: ProjectCreate, current_user: User = Depends(get_current_user)):
     project = Project(**project_data.model_dump())
     project_dict = project.model_dump()
-    project_dict['created_at'] = project_dict['created_at'].isoformat()
-    project_dict['updated_at'] = project_dict['updated_at'].isoformat()
-    if project_dict['deadline']:
-        project_dict['deadline'] = project_dict['deadline'].isoformat()
     await db.projects.insert_one(project_dict)
+    await record_project_status(None, project.status)
     
     # Log activity
     activity = Activity(
@@ -720,51 +1348,51 @@ async def create_project(project_data: ProjectCreate, current_user: User = Depen
         message=f"Project '{project.title}' created",
         actor=current_user.name
     )
-    activity_dict = activity.model_dump()
-    activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
-    await db.activity.insert_one(activity_dict)
+    await log_activity(activity)
     
     # Populate client name
-    client = await db.clients.find_one({"id": project.client_id}, {"_id": 0, "name": 1})
-    if client:
-        project.client_name = client['name']
+    client_names = await load_client_names([project.client_id])
+    project.client_name = client_names.get(project.client_id)
     
     return project
 
 @api_router.patch("/projects/{project_id}", response_model=Project)
 async def update_project(project_id: str, update_data: ProjectUpdate, current_user: User = Depends(get_current_user)):
-    existing = await db.projects.find_one({"id": project_id}, {"_id": 0})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Project not found")
-    
-    update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
+    update_dict = {k: v for k, v in update_data.model_dump(exclude={'version'}).items() if v is not None}
     if update_dict:
-        update_dict['updated_at'] = datetime.now(timezone.utc).isoformat()
-        if 'deadline' in update_dict and update_dict['deadline']:
-            update_dict['deadline'] = update_dict['deadline'].isoformat()
-        await db.projects.update_one({"id": project_id}, {"$set": update_dict})
-    
-    updated_project = await db.projects.find_one({"id": project_id}, {"_id": 0})
-    if isinstance(updated_project['created_at'], str):
-        updated_project['created_at'] = datetime.fromisoformat(updated_project['created_at'])
-    if isinstance(updated_project['updated_at'], str):
-        updated_project['updated_at'] = datetime.fromisoformat(updated_project['updated_at'])
-    if updated_project.get('deadline') and isinstance(updated_project['deadline'], str):
-        updated_project['deadline'] = datetime.fromisoformat(updated_project['deadline'])
+        update_dict['updated_at'] = datetime.now(timezone.utc)
+    previous, updated_project = await patch_document(
+        db.projects, project_id, update_dict,
+        version=update_data.version,
+        projection={"_id": 0, "deliverables": 0},
+        entity="Project"
+    )
+    if 'status' in update_dict:
+        await record_project_status(previous.get('status'), updated_project.get('status'))
+    decode_dates(updated_project)
     
     # Populate client name
-    if updated_project.get('client_id'):
-        client = await db.clients.find_one({"id": updated_project['client_id']}, {"_id": 0, "name": 1})
-        if client:
-            updated_project['client_name'] = client['name']
+    await populate_names([updated_project])
     
     return Project(**updated_project)
 
 @api_router.delete("/projects/{project_id}")
 async def delete_project(project_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.projects.delete_one({"id": project_id})
-    if result.deleted_count == 0:
+    deleted = await db.projects.find_one_and_delete({"id": project_id}, {"_id": 0, "status": 1})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Project not found")
+    await record_project_status(deleted.get('status'), None)
+    
+    deliverables = await db.deliverables.find(
+        {"project_id": project_id}, {"_id": 0, "sha256": 1, "file_path": 1}
+    ).to_list(None)
+    await db.deliverables.delete_many({"project_id": project_id})
+    # Delete the files from disk once nothing references them, like delete_deliverable
+    for sha256 in {d['sha256'] for d in deliverables if d.get('sha256')}:
+        await release_blob(sha256)
+    for deliverable in deliverables:
+        if not deliverable.get('sha256') and deliverable.get('file_path'):
+            Path(deliverable['file_path']).unlink(missing_ok=True)
     return {"message": "Project deleted successfully"}
 
 
@@ -774,6 +1402,17 @@ async def delete_project(project_id: str, current_user: User = Depends(get_curre
 UPLOADS_DIR = Path("/app/uploads/deliverables")
 UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Content-addressed blob store: one file per distinct SHA-256
+BLOBS_DIR = UPLOADS_DIR / "blobs"
+BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+
+# Thumbnails are keyed by the content hash of their source blob
+THUMBNAILS_DIR = UPLOADS_DIR / "thumbnails"
+THUMBNAILS_DIR.mkdir(parents=True, exist_ok=True)
+
+# Unreferenced blobs and abandoned temp files younger than this are left alone
+BLOB_GC_GRACE_SECONDS = int(os.environ.get('BLOB_GC_GRACE_SECONDS', 3600))
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {
     '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.csv',
@@ -781,6 +1420,275 @@ ALLOWED_EXTENSIONS = {
     '.zip', '.rar', '.tar', '.gz', '.txt', '.md'
 }
 
+# Download streaming
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 64 * 1024))
+
+# Upload limits
+MAX_DELIVERABLE_SIZE = int(os.environ.get('MAX_DELIVERABLE_SIZE', 10 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+# Room for the multipart boundaries and headers around the file itself
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+class UploadSizeLimitMiddleware:
+    """Rejects oversized deliverable uploads while the request body arrives
+    
+    Form parsing spools the whole body to disk before the route runs, so the limit has
+    to be applied here: on Content-Length up front, and on the bytes actually received
+    for chunked requests.
+    """
+    
+    def __init__(self, app, path_pattern: str, max_body_size: int):
+        self.app = app
+        self.path_pattern = re.compile(path_pattern)
+        self.max_body_size = max_body_size
+    
+    def _too_large(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File size exceeds {MAX_DELIVERABLE_SIZE // (1024 * 1024)}MB limit"
+        )
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not self.path_pattern.match(scope["path"]):
+            return await self.app(scope, receive, send)
+        
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            error = self._too_large()
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code, headers={"Connection": "close"})
+            return await response(scope, receive, send)
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # Raised inside form parsing, so the app's handlers turn it into a 413
+                    raise self._too_large()
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    path_pattern=r"^/api/projects/[^/]+/deliverables$",
+    max_body_size=MAX_DELIVERABLE_SIZE + UPLOAD_FORM_OVERHEAD
+)
+
+def blob_path(sha256: str) -> Path:
+    return BLOBS_DIR / sha256[:2] / sha256
+
+def place_blob(tmp_path: Path, sha256: str) -> Path:
+    """Move a hashed temp file into the blob store; identical content simply replaces itself"""
+    destination = blob_path(sha256)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    # Same filesystem, so the rename is atomic
+    os.replace(tmp_path, destination)
+    return destination
+
+async def stream_upload(file: UploadFile):
+    """Copy a received upload to a temp file chunk by chunk, hashing it and enforcing the exact size limit
+    
+    UploadSizeLimitMiddleware has already cut off bodies far over the limit while they arrived.
+    """
+    tmp = await asyncio.to_thread(
+        tempfile.NamedTemporaryFile, dir=BLOBS_DIR, suffix=".part", delete=False
+    )
+    digest = hashlib.sha256()
+    file_size = 0
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_DELIVERABLE_SIZE:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File size exceeds {MAX_DELIVERABLE_SIZE // (1024 * 1024)}MB limit"
+                )
+            digest.update(chunk)
+            await asyncio.to_thread(tmp.write, chunk)
+        await asyncio.to_thread(tmp.close)
+    except BaseException:
+        tmp.close()
+        Path(tmp.name).unlink(missing_ok=True)
+        raise
+    return Path(tmp.name), file_size, digest.hexdigest()
+
+async def blob_reference_count(sha256: str) -> int:
+    return await db.deliverables.count_documents({"sha256": sha256})
+
+async def release_blob(sha256: str):
+    """Unlink a blob once no deliverable references it any more
+    
+    An upload of the same content may record its reference and place the blob between
+    the count and the unlink, so the blob is first moved aside, the references are
+    counted again, and it is put back if it is still needed.
+    """
+    if await blob_reference_count(sha256) > 0:
+        return
+    path = blob_path(sha256)
+    # Named like an upload temp file so the GC sweeps it if we crash before finishing
+    condemned = path.with_name(f"{sha256}.{uuid.uuid4().hex}.part")
+    try:
+        await asyncio.to_thread(os.replace, path, condemned)
+    except FileNotFoundError:
+        return
+    
+    if await blob_reference_count(sha256) > 0 and not path.exists():
+        await asyncio.to_thread(os.replace, condemned, path)
+    else:
+        await asyncio.to_thread(condemned.unlink, missing_ok=True)
+
+async def collect_orphan_blobs() -> dict:
+    """Sweep blobs no deliverable references, plus temp files left by interrupted uploads"""
+    referenced = set(await db.deliverables.distinct("sha256"))
+    cutoff = time.time() - BLOB_GC_GRACE_SECONDS
+    
+    def sweep():
+        removed_blobs = removed_temp = 0
+        for path in [*BLOBS_DIR.rglob("*"), *THUMBNAILS_DIR.iterdir()]:
+            if not path.is_file() or path.stat().st_mtime > cutoff:
+                continue
+            if path.suffix == ".part":
+                path.unlink(missing_ok=True)
+                removed_temp += 1
+            elif path.name.split(".")[0] not in referenced:
+                path.unlink(missing_ok=True)
+                removed_blobs += 1
+        return {"removed_blobs": removed_blobs, "removed_temp_files": removed_temp}
+    
+    result = await asyncio.to_thread(sweep)
+    if result['removed_blobs'] or result['removed_temp_files']:
+        logger.info(f"Blob GC removed {result['removed_blobs']} blobs and {result['removed_temp_files']} temp files")
+    return result
+
+# ==================== DELIVERABLE THUMBNAILS ====================
+
+# Formats Pillow can decode; PDFs would need a rasterizer this app does not ship
+THUMBNAIL_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+thumbnail_pool = WorkerPool(
+    "thumbnail",
+    ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail"),
+    THUMBNAIL_WORKERS,
+    max_queue=THUMBNAIL_QUEUE_LIMIT
+)
+
+# In-flight jobs keyed by sha256, so identical content is rendered once; this also
+# keeps strong references to the tasks so they are not garbage collected
+thumbnail_jobs: dict = {}
+
+def thumbnail_path(sha256: str) -> Path:
+    return THUMBNAILS_DIR / f"{sha256}.webp"
+
+def supports_thumbnail(deliverable: dict) -> bool:
+    return bool(deliverable.get('sha256')) and Path(deliverable['filename']).suffix.lower() in THUMBNAIL_EXTENSIONS
+
+def render_thumbnail(source: Path, destination: Path, size: int):
+    """Downscale an image to fit size x size and write it as WebP"""
+    tmp = destination.with_name(f"{destination.stem}.{uuid.uuid4().hex}.part")
+    with PILImage.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image.save(tmp, "WEBP", quality=80)
+    os.replace(tmp, destination)
+
+async def generate_thumbnail(deliverable: dict):
+    """Render and cache the thumbnail for a deliverable's content, recording the outcome on every deliverable sharing it"""
+    destination = thumbnail_path(deliverable['sha256'])
+    thumbnail_status = "ready"
+    if not destination.exists():
+        try:
+            await thumbnail_pool.run(render_thumbnail, Path(deliverable['file_path']), destination, THUMBNAIL_SIZE)
+        except WorkerPoolSaturated:
+            # Left pending; the thumbnail endpoint schedules it again on demand
+            return
+        except Exception as e:
+            logger.warning(f"Thumbnail generation failed for deliverable {deliverable['id']}: {e}")
+            thumbnail_status = "failed"
+    await db.deliverables.update_many(
+        {"sha256": deliverable['sha256'], "thumbnail_status": "pending"},
+        {"$set": {"thumbnail_status": thumbnail_status}}
+    )
+
+def schedule_thumbnail(deliverable: dict):
+    """Queue thumbnail generation in the background without delaying the caller; joins a running job for the same content"""
+    sha256 = deliverable['sha256']
+    if sha256 in thumbnail_jobs:
+        return
+    task = asyncio.create_task(generate_thumbnail(deliverable))
+    thumbnail_jobs[sha256] = task
+    task.add_done_callback(lambda _: thumbnail_jobs.pop(sha256, None))
+
+def parse_byte_range(range_header: str, file_size: int):
+    """Parse a single "bytes=" range into inclusive (start, end); None serves the whole file"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        # Multiple ranges are optional; answer with the full representation
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else file_size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(file_size - int(end_text), 0)
+            end = file_size - 1
+    except ValueError:
+        return None
+    if start >= file_size or start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+    return start, min(end, file_size - 1)
+
+async def iter_file_range(path: Path, start: int, length: int):
+    """Yield length bytes of a file from start, reading in worker threads"""
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Evaluate If-None-Match (which wins) or If-Modified-Since against the stored file"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        weak_etag = etag[2:] if etag.startswith("W/") else etag
+        return "*" in candidates or any(tag.removeprefix("W/") == weak_etag for tag in candidates)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def range_applies(request: Request, etag: str, last_modified: str) -> bool:
+    """If-Range only allows a partial response while the validator still matches"""
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if if_range.startswith('"'):
+        # Only strong validators may be used with If-Range
+        return not etag.startswith("W/") and if_range == etag
+    return if_range == last_modified
+
 @api_router.post("/projects/{project_id}/deliverables", response_model=Deliverable)
 async def add_deliverable(
     project_id: str,
@@ -789,7 +1697,7 @@ async def add_deliverable(
     current_user: User = Depends(get_current_user)
 ):
     """Add a deliverable to a project with file upload"""
-    project = await db.projects.find_one({"id": project_id}, {"_id": 0})
+    project = await db.projects.find_one({"id": project_id}, {"_id": 0, "id": 1})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -801,41 +1709,40 @@ async def add_deliverable(
             detail=f"File type {file_ext} not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
         )
     
-    # Generate unique filename
-    unique_id = str(uuid.uuid4())
-    safe_filename = f"{unique_id}_{file.filename}"
-    file_path = UPLOADS_DIR / safe_filename
-    
     # Save file
-    content = await file.read()
-    file_size = len(content)
-    
-    # Check file size (max 10MB)
-    if file_size > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File size exceeds 10MB limit")
-    
-    with open(file_path, "wb") as f:
-        f.write(content)
+    tmp_path, file_size, sha256 = await stream_upload(file)
     
     # Create deliverable
     deliverable = Deliverable(
+        project_id=project_id,
         name=name,
         filename=file.filename,
-        file_path=str(file_path),
+        file_path=str(blob_path(sha256)),
         file_size=file_size,
-        file_type=file.content_type or "application/octet-stream"
+        file_type=file.content_type or "application/octet-stream",
+        sha256=sha256
     )
+    if supports_thumbnail(deliverable.model_dump()):
+        deliverable.thumbnail_status = "pending"
     deliverable_dict = deliverable.model_dump()
-    deliverable_dict['uploaded_at'] = deliverable_dict['uploaded_at'].isoformat()
     
-    # Add to project's deliverables array
-    await db.projects.update_one(
-        {"id": project_id},
-        {
-            "$push": {"deliverables": deliverable_dict},
-            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-        }
-    )
+    # The reference is recorded before the blob is placed; release_blob re-counts
+    # references after moving a blob aside, so a concurrent delete gives it back
+    inserted = False
+    try:
+        await db.deliverables.insert_one(deliverable_dict)
+        inserted = True
+        await asyncio.to_thread(place_blob, tmp_path, sha256)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        if inserted:
+            # Do not leave a record pointing at a blob that was never placed
+            await db.deliverables.delete_one({"id": deliverable.id})
+        raise
+    await db.projects.update_one({"id": project_id}, {"$set": {"updated_at": datetime.now(timezone.utc)}})
+    
+    if deliverable.thumbnail_status == "pending":
+        schedule_thumbnail(deliverable_dict)
     
     # Log activity
     activity = Activity(
@@ -845,53 +1752,112 @@ async def add_deliverable(
         message=f"Deliverable '{deliverable.name}' ({file.filename}) added to project",
         actor=current_user.name
     )
-    activity_dict = activity.model_dump()
-    activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
-    await db.activity.insert_one(activity_dict)
+    await log_activity(activity)
     
     return deliverable
 
 @api_router.get("/projects/{project_id}/deliverables", response_model=List[Deliverable])
 async def get_deliverables(project_id: str, current_user: User = Depends(get_current_user)):
     """Get all deliverables for a project"""
-    project = await db.projects.find_one({"id": project_id}, {"_id": 0})
+    project = await db.projects.find_one({"id": project_id}, {"_id": 0, "id": 1})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    deliverables = project.get('deliverables', [])
+    deliverables = await db.deliverables.find({"project_id": project_id}, {"_id": 0}).sort("uploaded_at", 1).to_list(None)
     for d in deliverables:
-        if isinstance(d['uploaded_at'], str):
-            d['uploaded_at'] = datetime.fromisoformat(d['uploaded_at'])
+        decode_dates(d)
     
     return deliverables
 
 @api_router.get("/deliverables/download/{deliverable_id}")
 async def download_deliverable(
     deliverable_id: str,
+    request: Request,
     current_user: User = Depends(get_current_user)
 ):
     """Download a deliverable file"""
-    # Find the deliverable in any project
-    project = await db.projects.find_one(
-        {"deliverables.id": deliverable_id},
-        {"_id": 0, "deliverables.$": 1}
-    )
-    
-    if not project or not project.get('deliverables'):
+    deliverable = await db.deliverables.find_one({"id": deliverable_id}, {"_id": 0})
+    if not deliverable:
         raise HTTPException(status_code=404, detail="Deliverable not found")
     
-    deliverable = project['deliverables'][0]
     file_path = Path(deliverable['file_path'])
     
-    if not file_path.exists():
+    try:
+        stat_result = await asyncio.to_thread(file_path.stat)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found on server")
     
-    return FileResponse(
-        path=file_path,
-        filename=deliverable['filename'],
-        media_type=deliverable.get('file_type', 'application/octet-stream')
+    file_size = stat_result.st_size
+    media_type = deliverable.get('file_type', 'application/octet-stream')
+    # Content hashes give strong validators; legacy files fall back to a weak size/mtime tag
+    if deliverable.get('sha256'):
+        etag = f'"{deliverable["sha256"]}"'
+    else:
+        etag = f'W/"{file_size:x}-{int(stat_result.st_mtime):x}"'
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache"
+    }
+    
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    range_header = request.headers.get("range")
+    byte_range = None
+    if range_header and range_applies(request, etag, last_modified):
+        byte_range = parse_byte_range(range_header, file_size)
+    
+    if byte_range is None:
+        return FileResponse(
+            path=file_path,
+            filename=deliverable['filename'],
+            media_type=media_type,
+            headers=headers
+        )
+    
+    start, end = byte_range
+    length = end - start + 1
+    return StreamingResponse(
+        iter_file_range(file_path, start, length),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers={
+            **headers,
+            "Content-Range": f"bytes {start}-{end}/{file_size}",
+            "Content-Length": str(length),
+            "Content-Disposition": f"attachment; filename*=utf-8''{quote(deliverable['filename'])}"
+        }
     )
 
+@api_router.get("/deliverables/{deliverable_id}/thumbnail")
+async def get_deliverable_thumbnail(
+    deliverable_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Serve a cached preview image of a deliverable"""
+    deliverable = await db.deliverables.find_one({"id": deliverable_id}, {"_id": 0})
+    if not deliverable:
+        raise HTTPException(status_code=404, detail="Deliverable not found")
+    if not supports_thumbnail(deliverable) or deliverable.get('thumbnail_status') == "failed":
+        raise HTTPException(status_code=404, detail="No thumbnail available for this deliverable")
+    
+    path = thumbnail_path(deliverable['sha256'])
+    if not await asyncio.to_thread(path.exists):
+        # Not rendered yet (or evicted): render it in the background
+        schedule_thumbnail(deliverable)
+        return Response(status_code=status.HTTP_202_ACCEPTED, headers={"Retry-After": "2"})
+    
+    # Thumbnails are derived from immutable content, so they can be cached for good
+    etag = f'"{deliverable["sha256"]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return FileResponse(path=path, media_type="image/webp", headers=headers)
+
 @api_router.delete("/projects/{project_id}/deliverables/{deliverable_id}")
 async def delete_deliverable(
     project_id: str,
@@ -899,33 +1865,25 @@ async def delete_deliverable(
     current_user: User = Depends(get_current_user)
 ):
     """Remove a deliverable from a project"""
-    project = await db.projects.find_one({"id": project_id}, {"_id": 0})
+    project = await db.projects.find_one({"id": project_id}, {"_id": 0, "id": 1})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
     # Find and remove the deliverable
-    deliverables = project.get('deliverables', [])
-    deliverable_to_remove = None
-    for d in deliverables:
-        if d['id'] == deliverable_id:
-            deliverable_to_remove = d
-            break
-    
+    deliverable_to_remove = await db.deliverables.find_one_and_delete(
+        {"id": deliverable_id, "project_id": project_id},
+        projection={"_id": 0}
+    )
     if not deliverable_to_remove:
         raise HTTPException(status_code=404, detail="Deliverable not found")
     
-    # Delete the file from disk
-    file_path = Path(deliverable_to_remove['file_path'])
-    if file_path.exists():
-        file_path.unlink()
+    await db.projects.update_one({"id": project_id}, {"$set": {"updated_at": datetime.now(timezone.utc)}})
     
-    await db.projects.update_one(
-        {"id": project_id},
-        {
-            "$pull": {"deliverables": {"id": deliverable_id}},
-            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
-        }
-    )
+    # Delete the file from disk once nothing references it
+    if deliverable_to_remove.get('sha256'):
+        await release_blob(deliverable_to_remove['sha256'])
+    else:
+        Path(deliverable_to_remove['file_path']).unlink(missing_ok=True)
     
     # Log activity
     activity = Activity(
@@ -935,12 +1893,108 @@ async def delete_deliverable(
         message=f"Deliverable '{deliverable_to_remove['name']}' removed from project",
         actor=current_user.name
     )
-    activity_dict = activity.model_dump()
-    activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
-    await db.activity.insert_one(activity_dict)
+    await log_activity(activity)
     
     return {"message": "Deliverable deleted successfully"}
 
+class _ZipOutput:
+    """Write-only sink for zipfile; the archive is drained chunk by chunk as it is produced"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def unique_arcname(filename: str, used: set) -> str:
+    """Archive entry name for an uploaded filename: a bare, unique name that cannot escape on extraction"""
+    # Client-supplied names may carry directories, drive letters or "..", any of which
+    # would write outside the extraction directory
+    filename = filename.replace("\\", "/").rsplit("/", 1)[-1].replace(":", "_").strip()
+    if filename in ("", ".", ".."):
+        filename = "file"
+    stem, suffix = Path(filename).stem, Path(filename).suffix
+    arcname, counter = filename, 1
+    while arcname in used:
+        counter += 1
+        arcname = f"{stem} ({counter}){suffix}"
+    used.add(arcname)
+    return arcname
+
+def stored_zip_size(entries) -> Optional[int]:
+    """Exact size of a ZIP_STORED archive streamed with data descriptors, or None if it needs ZIP64"""
+    total = 22  # end of central directory record
+    for arcname, _, file_size, _ in entries:
+        name_length = len(arcname.encode("utf-8"))
+        # local header + data + data descriptor + central directory entry
+        total += 30 + name_length + file_size + 16 + 46 + name_length
+    # zipfile switches an entry to ZIP64 once its size is within 5% of the limit
+    needs_zip64 = any(file_size * 1.05 > zipfile.ZIP64_LIMIT for _, _, file_size, _ in entries)
+    if needs_zip64 or total > zipfile.ZIP64_LIMIT or len(entries) >= zipfile.ZIP_FILECOUNT_LIMIT:
+        return None
+    return total
+
+async def iter_zip(entries):
+    """Stream a ZIP_STORED archive of (arcname, path, size, mtime) entries with constant memory"""
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as archive:
+        for arcname, path, file_size, mtime in entries:
+            info = zipfile.ZipInfo(arcname, date_time=datetime.fromtimestamp(max(mtime, 315532800)).timetuple()[:6])
+            info.file_size = file_size
+            with archive.open(info, "w") as dest:
+                async for chunk in iter_file_range(path, 0, file_size):
+                    dest.write(chunk)
+                    yield output.drain()
+            yield output.drain()
+    yield output.drain()
+
+@api_router.get("/projects/{project_id}/deliverables/archive")
+async def download_deliverables_archive(project_id: str, current_user: User = Depends(get_current_user)):
+    """Stream every deliverable of a project as a single ZIP archive"""
+    project = await db.projects.find_one({"id": project_id}, {"_id": 0, "id": 1, "title": 1})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    deliverables = await db.deliverables.find(
+        {"project_id": project_id},
+        {"_id": 0, "filename": 1, "file_path": 1}
+    ).sort("uploaded_at", 1).to_list(None)
+    
+    def collect_entries():
+        entries, used = [], set()
+        for d in deliverables:
+            path = Path(d['file_path'])
+            try:
+                stat_result = path.stat()
+            except FileNotFoundError:
+                logger.warning(f"Skipping missing deliverable file {path} in project {project_id} archive")
+                continue
+            entries.append((unique_arcname(d['filename'], used), path, stat_result.st_size, stat_result.st_mtime))
+        return entries
+    
+    entries = await asyncio.to_thread(collect_entries)
+    
+    headers = {"Content-Disposition": f"attachment; filename*=utf-8''{quote(project['title'])}.zip"}
+    archive_size = stored_zip_size(entries)
+    if archive_size is not None:
+        headers["Content-Length"] = str(archive_size)
+    
+    return StreamingResponse(iter_zip(entries), media_type="application/zip", headers=headers)
+
+@api_router.post("/deliverables/gc")
+async def garbage_collect_deliverables(current_user: User = Depends(get_current_user)):
+    """Remove stored files that no deliverable references"""
+    return await collect_orphan_blobs()
+
 
 # ==================== INVOICES ROUTES ====================
 
@@ -948,45 +2002,18 @@ async def delete_deliverable(
 async def get_invoices(
     current_user: User = Depends(get_current_user),
     page: int = 1,
-    page_size: int = 10
+    page_size: int = 10,
+    engine: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None
 ):
-    skip = (page - 1) * page_size
-    total = await db.invoices.count_documents({})
-    
-    invoices = await db.invoices.find({}, {"_id": 0}).skip(skip).limit(page_size).to_list(page_size)
+    invoices, meta = await fetch_page(db.invoices, page, page_size, engine=engine, after=after, before=before, lookups=[CLIENT_NAME_LOOKUP, PROJECT_TITLE_LOOKUP])
     for invoice in invoices:
-        if isinstance(invoice['created_at'], str):
-            invoice['created_at'] = datetime.fromisoformat(invoice['created_at'])
-        if isinstance(invoice['updated_at'], str):
-            invoice['updated_at'] = datetime.fromisoformat(invoice['updated_at'])
-        if isinstance(invoice['issued_date'], str):
-            invoice['issued_date'] = datetime.fromisoformat(invoice['issued_date'])
-        if isinstance(invoice['due_date'], str):
-            invoice['due_date'] = datetime.fromisoformat(invoice['due_date'])
-        if invoice.get('paid_at') and isinstance(invoice['paid_at'], str):
-            invoice['paid_at'] = datetime.fromisoformat(invoice['paid_at'])
-        
-        # Populate client and project names
-        if invoice.get('client_id'):
-            client = await db.clients.find_one({"id": invoice['client_id']}, {"_id": 0, "name": 1})
-            if client:
-                invoice['client_name'] = client['name']
-        
-        if invoice.get('project_id'):
-            project = await db.projects.find_one({"id": invoice['project_id']}, {"_id": 0, "title": 1})
-            if project:
-                invoice['project_title'] = project['title']
-    
-    total_pages = (total + page_size - 1) // page_size
+        decode_dates(invoice)
     
     return {
         "items": invoices,
-        "meta": {
-            "total": total,
-            "page": page,
-            "page_size": page_size,
-            "total_pages": total_pages
-        }
+        "meta": meta
     }
 
 @api_router.get("/invoices/{invoice_id}", response_model=Invoice)
@@ -995,42 +2022,17 @@ async def get_invoice(invoice_id: str, current_user: User = Depends(get_current_
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    if isinstance(invoice['created_at'], str):
-        invoice['created_at'] = datetime.fromisoformat(invoice['created_at'])
-    if isinstance(invoice['updated_at'], str):
-        invoice['updated_at'] = datetime.fromisoformat(invoice['updated_at'])
-    if isinstance(invoice['issued_date'], str):
-        invoice['issued_date'] = datetime.fromisoformat(invoice['issued_date'])
-    if isinstance(invoice['due_date'], str):
-        invoice['due_date'] = datetime.fromisoformat(invoice['due_date'])
-    if invoice.get('paid_at') and isinstance(invoice['paid_at'], str):
-        invoice['paid_at'] = datetime.fromisoformat(invoice['paid_at'])
+    decode_dates(invoice)
     
     # Populate client and project names
-    if invoice.get('client_id'):
-        client = await db.clients.find_one({"id": invoice['client_id']}, {"_id": 0, "name": 1})
-        if client:
-            invoice['client_name'] = client['name']
-    
-    if invoice.get('project_id'):
-        project = await db.projects.find_one({"id": invoice['project_id']}, {"_id": 0, "title": 1})
-        if project:
-            invoice['project_title'] = project['title']
+    await populate_names([invoice], projects=True)
     
     return Invoice(**invoice)
 
 @api_router.post("/invoices", response_model=Invoice)
 async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depends(get_current_user)):
     # Generate invoice number
-    last_invoice = await db.invoices.find_one({}, {"_id": 0, "number": 1}, sort=[("created_at", -1)])
-    if last_invoice and last_invoice.get('number'):
-        try:
-            last_num = int(last_invoice['number'].split('-')[1])
-            invoice_number = f"INV-{last_num + 1}"
-        except:
-            invoice_number = f"INV-{1001}"
-    else:
-        invoice_number = "INV-1001"
+    invoice_number, = await allocate_invoice_numbers()
     
     # Calculate line items totals
     line_items_with_totals = []
@@ -1058,13 +2060,8 @@ async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depen
     )
     
     invoice_dict = invoice.model_dump()
-    invoice_dict['created_at'] = invoice_dict['created_at'].isoformat()
-    invoice_dict['updated_at'] = invoice_dict['updated_at'].isoformat()
-    invoice_dict['issued_date'] = invoice_dict['issued_date'].isoformat()
-    invoice_dict['due_date'] = invoice_dict['due_date'].isoformat()
-    if invoice_dict['paid_at']:
-        invoice_dict['paid_at'] = invoice_dict['paid_at'].isoformat()
     await db.invoices.insert_one(invoice_dict)
+    await publish_change("invoices", "insert", invoice_dict)
     
     # Log activity
     activity = Activity(
@@ -1074,29 +2071,27 @@ async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depen
         message=f"Invoice {invoice.number} created (Total: €{total:.2f})",
         actor=current_user.name
     )
-    activity_dict = activity.model_dump()
-    activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
-    await db.activity.insert_one(activity_dict)
+    await log_activity(activity)
     
     # Populate client and project names
-    client = await db.clients.find_one({"id": invoice.client_id}, {"_id": 0, "name": 1})
-    if client:
-        invoice.client_name = client['name']
-    
-    if invoice.project_id:
-        project = await db.projects.find_one({"id": invoice.project_id}, {"_id": 0, "title": 1})
-        if project:
-            invoice.project_title = project['title']
+    client_names = await load_client_names([invoice.client_id])
+    project_titles = await load_project_titles([invoice.project_id])
+    invoice.client_name = client_names.get(invoice.client_id)
+    invoice.project_title = project_titles.get(invoice.project_id)
     
     return invoice
 
+def apply_invoice_totals(invoice: dict):
+    """Recompute the TVA amount and total the way update_invoice asks the database to"""
+    subtotal = invoice.get('subtotal') or 0.0
+    invoice['tva_amount'] = subtotal * ((invoice.get('tva_rate') or 0.0) / 100)
+    invoice['total'] = subtotal + invoice['tva_amount']
+
 @api_router.patch("/invoices/{invoice_id}", response_model=Invoice)
 async def update_invoice(invoice_id: str, update_data: InvoiceUpdate, current_user: User = Depends(get_current_user)):
-    existing = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    
     update_dict = {}
+    # Totals that depend on the stored invoice are computed by the database
+    computed = {}
     
     # Handle line items update if provided
     if update_data.line_items is not None:
@@ -1111,68 +2106,63 @@ async def update_invoice(invoice_id: str, update_data: InvoiceUpdate, current_us
             line_items_with_totals.append(line_item.model_dump())
             subtotal += item_total
         
-        # Use updated or existing TVA rate
-        tva_rate = update_data.tva_rate if update_data.tva_rate is not None else existing.get('tva_rate', 0.0)
-        tva_amount = subtotal * (tva_rate / 100)
-        total = subtotal + tva_amount
-        
         update_dict['line_items'] = line_items_with_totals
         update_dict['subtotal'] = subtotal
-        update_dict['tva_rate'] = tva_rate
-        update_dict['tva_amount'] = tva_amount
-        update_dict['total'] = total
+        
+        if update_data.tva_rate is not None:
+            tva_amount = subtotal * (update_data.tva_rate / 100)
+            update_dict['tva_rate'] = update_data.tva_rate
+            update_dict['tva_amount'] = tva_amount
+            update_dict['total'] = subtotal + tva_amount
+        else:
+            # Keep the existing TVA rate
+            tva_amount = {"$multiply": [subtotal, {"$divide": [{"$ifNull": ["$tva_rate", 0.0]}, 100]}]}
+            computed['tva_amount'] = tva_amount
+            computed['total'] = {"$add": [subtotal, tva_amount]}
     elif update_data.tva_rate is not None:
-        # Only TVA rate changed, recalculate
-        subtotal = existing.get('subtotal', 0.0)
-        tva_amount = subtotal * (update_data.tva_rate / 100)
-        total = subtotal + tva_amount
+        # Only TVA rate changed, recalculate from the stored subtotal
+        subtotal = {"$ifNull": ["$subtotal", 0.0]}
+        tva_amount = {"$multiply": [subtotal, update_data.tva_rate / 100]}
         
         update_dict['tva_rate'] = update_data.tva_rate
-        update_dict['tva_amount'] = tva_amount
-        update_dict['total'] = total
+        computed['tva_amount'] = tva_amount
+        computed['total'] = {"$add": [subtotal, tva_amount]}
     
     # Add other updates
     if update_data.status is not None:
         update_dict['status'] = update_data.status
     if update_data.paid_at is not None:
-        update_dict['paid_at'] = update_data.paid_at.isoformat()
+        update_dict['paid_at'] = update_data.paid_at
     if update_data.stripe_payment_intent_id is not None:
         update_dict['stripe_payment_intent_id'] = update_data.stripe_payment_intent_id
     
     if update_dict:
-        update_dict['updated_at'] = datetime.now(timezone.utc).isoformat()
-        await db.invoices.update_one({"id": invoice_id}, {"$set": update_dict})
-    
-    updated_invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
-    if isinstance(updated_invoice['created_at'], str):
-        updated_invoice['created_at'] = datetime.fromisoformat(updated_invoice['created_at'])
-    if isinstance(updated_invoice['updated_at'], str):
-        updated_invoice['updated_at'] = datetime.fromisoformat(updated_invoice['updated_at'])
-    if isinstance(updated_invoice['issued_date'], str):
-        updated_invoice['issued_date'] = datetime.fromisoformat(updated_invoice['issued_date'])
-    if isinstance(updated_invoice['due_date'], str):
-        updated_invoice['due_date'] = datetime.fromisoformat(updated_invoice['due_date'])
-    if updated_invoice.get('paid_at') and isinstance(updated_invoice['paid_at'], str):
-        updated_invoice['paid_at'] = datetime.fromisoformat(updated_invoice['paid_at'])
+        update_dict['updated_at'] = datetime.now(timezone.utc)
+    previous, updated_invoice = await patch_document(
+        db.invoices, invoice_id, update_dict, computed,
+        derive=apply_invoice_totals if computed else None,
+        version=update_data.version,
+        entity="Invoice"
+    )
+    if update_dict:
+        await pdf_cache.invalidate(invoice_id)
+    decode_dates(updated_invoice)
+    if REVENUE_FIELDS & update_dict.keys():
+        await record_invoice_revenue(previous, updated_invoice)
     
     # Populate client and project names
-    if updated_invoice.get('client_id'):
-        client = await db.clients.find_one({"id": updated_invoice['client_id']}, {"_id": 0, "name": 1})
-        if client:
-            updated_invoice['client_name'] = client['name']
-    
-    if updated_invoice.get('project_id'):
-        project = await db.projects.find_one({"id": updated_invoice['project_id']}, {"_id": 0, "title": 1})
-        if project:
-            updated_invoice['project_title'] = project['title']
+    await populate_names([updated_invoice], projects=True)
     
     return Invoice(**updated_invoice)
 
 @api_router.delete("/invoices/{invoice_id}")
 async def delete_invoice(invoice_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.invoices.delete_one({"id": invoice_id})
-    if result.deleted_count == 0:
+    deleted = await db.invoices.find_one_and_delete({"id": invoice_id}, {"_id": 0})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Invoice not found")
+    await pdf_cache.invalidate(invoice_id)
+    await record_invoice_revenue(deleted, None)
+    await publish_change("invoices", "delete", deleted)
     return {"message": "Invoice deleted successfully"}
 
 
@@ -1231,7 +2221,7 @@ async def create_payment_link(invoice_id: str, current_user: User = Depends(get_
     
     try:
         # Create Stripe Checkout Session
-        session = stripe.checkout.Session.create(
+        session = await stripe_gateway.create_checkout_session(
             payment_method_types=['card'],
             line_items=stripe_line_items,
             mode='payment',
@@ -1246,16 +2236,19 @@ async def create_payment_link(invoice_id: str, current_user: User = Depends(get_
         )
         
         # Update invoice with payment link and session ID
-        await db.invoices.update_one(
+        changes = {
+            "payment_link": session.url,
+            "stripe_checkout_session_id": session.id,
+            "updated_at": datetime.now(timezone.utc)
+        }
+        updated = await db.invoices.find_one_and_update(
             {"id": invoice_id},
-            {
-                "$set": {
-                    "payment_link": session.url,
-                    "stripe_checkout_session_id": session.id,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
+            {"$set": changes, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
         )
+        if updated:
+            await publish_change("invoices", "update", updated, {**changes, "version": updated.get('version')})
         
         return PaymentLinkResponse(
             payment_link=session.url,
@@ -1273,22 +2266,10 @@ async def get_public_invoice(invoice_id: str):
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    # Convert datetime strings
-    for field in ['created_at', 'updated_at', 'issued_date', 'due_date']:
-        if isinstance(invoice.get(field), str):
-            invoice[field] = datetime.fromisoformat(invoice[field])
-    if invoice.get('paid_at') and isinstance(invoice['paid_at'], str):
-        invoice['paid_at'] = datetime.fromisoformat(invoice['paid_at'])
+    decode_dates(invoice)
     
     # Populate client and project names
-    client = await db.clients.find_one({"id": invoice['client_id']}, {"_id": 0, "name": 1})
-    if client:
-        invoice['client_name'] = client['name']
-    
-    if invoice.get('project_id'):
-        project = await db.projects.find_one({"id": invoice['project_id']}, {"_id": 0, "title": 1})
-        if project:
-            invoice['project_title'] = project['title']
+    await populate_names([invoice], projects=True)
     
     return Invoice(**invoice)
 
@@ -1306,22 +2287,30 @@ async def verify_payment(invoice_id: str, session_id: str = None):
     # Check with Stripe if we have a session ID
     if session_id:
         try:
-            session = stripe.checkout.Session.retrieve(session_id)
+            session = await stripe_gateway.retrieve_checkout_session(session_id)
             
             # If payment was successful, update invoice
             if session.payment_status == 'paid':
                 now = datetime.now(timezone.utc)
-                await db.invoices.update_one(
-                    {"id": invoice_id},
-                    {
-                        "$set": {
-                            "status": "paid",
-                            "paid_at": now.isoformat(),
-                            "stripe_payment_intent_id": session.payment_intent,
-                            "updated_at": now.isoformat()
-                        }
-                    }
+                changes = {
+                    "status": "paid",
+                    "paid_at": now,
+                    "stripe_payment_intent_id": session.payment_intent,
+                    "updated_at": now
+                }
+                # The webhook may have recorded this payment already
+                previous = await db.invoices.find_one_and_update(
+                    {"id": invoice_id, "status": {"$ne": "paid"}},
+                    {"$set": changes, "$inc": {"version": 1}},
+                    projection={"_id": 0},
+                    return_document=ReturnDocument.BEFORE
                 )
+                if not previous:
+                    return {"status": "paid", "message": "Invoice already paid"}
+                
+                paid = {**previous, **changes, "version": (previous.get('version') or 0) + 1}
+                await record_invoice_revenue(previous, paid)
+                await publish_change("invoices", "update", paid, changed_fields(previous, paid))
                 
                 # Create payment record
                 payment = Payment(
@@ -1333,8 +2322,9 @@ async def verify_payment(invoice_id: str, session_id: str = None):
                     stripe_payment_intent_id=session.payment_intent
                 )
                 payment_dict = payment.model_dump()
-                payment_dict['created_at'] = payment_dict['created_at'].isoformat()
                 await db.payments.insert_one(payment_dict)
+                await publish_change("payments", "insert", payment_dict)
+                await record_payment(payment_dict)
                 
                 # Log activity
                 client = await db.clients.find_one({"id": invoice['client_id']}, {"_id": 0, "name": 1})
@@ -1345,9 +2335,7 @@ async def verify_payment(invoice_id: str, session_id: str = None):
                     message=f"Invoice {invoice['number']} paid via Stripe Checkout - €{session.amount_total / 100:.2f}",
                     actor=client['name'] if client else "Client"
                 )
-                activity_dict = activity.model_dump()
-                activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
-                await db.activity.insert_one(activity_dict)
+                await log_activity(activity)
                 
                 return {"status": "paid", "message": "Payment verified and invoice updated"}
         except Exception as e:
@@ -1359,22 +2347,8 @@ async def verify_payment(invoice_id: str, session_id: str = None):
 
 # ==================== PDF INVOICE GENERATION ====================
 
-@api_router.get("/invoices/{invoice_id}/pdf")
-async def generate_invoice_pdf(invoice_id: str, current_user: User = Depends(get_current_user)):
-    """Generate a professional PDF invoice with line items and TVA"""
-    # Get invoice
-    invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    
-    # Get client
-    client = await db.clients.find_one({"id": invoice['client_id']}, {"_id": 0})
-    
-    # Get project if available
-    project = None
-    if invoice.get('project_id'):
-        project = await db.projects.find_one({"id": invoice['project_id']}, {"_id": 0})
-    
+def render_invoice_pdf(invoice: dict, client: Optional[dict], project: Optional[dict]) -> bytes:
+    """Render an invoice snapshot to PDF bytes; runs in the PDF process pool"""
     # Create PDF buffer
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=50, leftMargin=50, topMargin=50, bottomMargin=30)
@@ -1431,11 +2405,11 @@ async def generate_invoice_pdf(invoice_id: str, current_user: User = Depends(get
     # Two-column layout for invoice info and bill to
     info_data = [
         [
-            Paragraph("<b>INVOICE DATE</b><br/><font color='#6B7280'>" + datetime.fromisoformat(invoice['issued_date']).strftime('%B %d, %Y') + "</font>", normal_style),
+            Paragraph("<b>INVOICE DATE</b><br/><font color='#6B7280'>" + invoice['issued_date'].strftime('%B %d, %Y') + "</font>", normal_style),
             Paragraph("<b>BILL TO</b><br/><font color='#111827'><b>" + (client['name'] if client else 'N/A') + "</b></font><br/><font color='#6B7280'>" + (client.get('company', '') if client else '') + "</font>", normal_style)
         ],
         [
-            Paragraph("<b>DUE DATE</b><br/><font color='#6B7280'>" + datetime.fromisoformat(invoice['due_date']).strftime('%B %d, %Y') + "</font>", normal_style),
+            Paragraph("<b>DUE DATE</b><br/><font color='#6B7280'>" + invoice['due_date'].strftime('%B %d, %Y') + "</font>", normal_style),
             Paragraph("<font color='#6B7280'>" + (client['email'] if client else '') + "<br/>" + (client.get('phone', '') if client else '') + "</font>", normal_style)
         ]
     ]
@@ -1540,12 +2514,113 @@ async def generate_invoice_pdf(invoice_id: str, current_user: User = Depends(get
     
     # Build PDF
     doc.build(elements)
-    buffer.seek(0)
+    return buffer.getvalue()
+
+class PdfCache:
+    """Rendered invoices keyed by invoice id and a version hash of everything the document shows"""
+    
+    def __init__(self, max_entries: int, directory: Optional[Path] = None):
+        self.memory = TTLCache(max_entries)
+        self.directory = directory
+        if directory:
+            directory.mkdir(parents=True, exist_ok=True)
+    
+    @staticmethod
+    def version(invoice: dict, client: Optional[dict], project: Optional[dict]) -> str:
+        snapshot = json.dumps([invoice, client, project], default=str, sort_keys=True)
+        return hashlib.sha256(snapshot.encode()).hexdigest()
+    
+    def _disk_path(self, invoice_id: str, version: str) -> Path:
+        return self.directory / f"{invoice_id}-{version}.pdf"
+    
+    async def get(self, invoice_id: str, version: str) -> Optional[bytes]:
+        entry = self.memory.get(invoice_id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        if self.directory:
+            path = self._disk_path(invoice_id, version)
+            try:
+                pdf_bytes = await asyncio.to_thread(path.read_bytes)
+            except FileNotFoundError:
+                return None
+            self.memory.set(invoice_id, (version, pdf_bytes))
+            return pdf_bytes
+        return None
+    
+    async def set(self, invoice_id: str, version: str, pdf_bytes: bytes):
+        if self.directory:
+            # Drop older versions before writing the new one
+            await self.invalidate(invoice_id)
+            await asyncio.to_thread(self._disk_path(invoice_id, version).write_bytes, pdf_bytes)
+        self.memory.set(invoice_id, (version, pdf_bytes))
+    
+    def _remove_files(self, invoice_id: str):
+        # The id comes from the URL, so wildcards in it must not match other invoices
+        for path in self.directory.glob(f"{glob.escape(invoice_id)}-*.pdf"):
+            path.unlink(missing_ok=True)
+    
+    async def invalidate(self, invoice_id: str):
+        # Client and project edits need no invalidation: they change the version hash,
+        # so stale entries are never served and the next set() replaces them
+        self.memory.invalidate(invoice_id)
+        if self.directory:
+            await asyncio.to_thread(self._remove_files, invoice_id)
+
+pdf_cache = PdfCache(PDF_CACHE_MAX_ENTRIES, Path(PDF_CACHE_DIR) if PDF_CACHE_DIR else None)
+
+pdf_pool = WorkerPool(
+    "pdf",
+    # Forking a process that already runs threads (Motor monitors, the other pools) can
+    # deadlock the child, so workers start from a clean forkserver instead
+    ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("forkserver")),
+    PDF_WORKERS,
+    max_queue=PDF_QUEUE_LIMIT
+)
+
+@api_router.get("/invoices/{invoice_id}/pdf")
+async def generate_invoice_pdf(invoice_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Generate a professional PDF invoice with line items and TVA"""
+    # Get invoice
+    invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    decode_dates(invoice)
     
-    return StreamingResponse(
-        buffer,
+    # Get client
+    client = await db.clients.find_one(
+        {"id": invoice['client_id']},
+        {"_id": 0, "name": 1, "company": 1, "email": 1, "phone": 1}
+    )
+    
+    # Get project if available
+    project = None
+    if invoice.get('project_id'):
+        project = await db.projects.find_one({"id": invoice['project_id']}, {"_id": 0, "title": 1})
+    
+    version = PdfCache.version(invoice, client, project)
+    headers = {
+        "ETag": f'"{version}"',
+        "Cache-Control": "private, no-cache"
+    }
+    if request.headers.get("if-none-match") in (f'"{version}"', f'W/"{version}"'):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    pdf_bytes = await pdf_cache.get(invoice_id, version)
+    if pdf_bytes is None:
+        try:
+            pdf_bytes = await pdf_pool.run(render_invoice_pdf, invoice, client, project)
+        except WorkerPoolSaturated:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="PDF rendering is busy, please retry shortly",
+                headers={"Retry-After": str(PDF_RETRY_AFTER_SECONDS)}
+            )
+        await pdf_cache.set(invoice_id, version, pdf_bytes)
+    
+    return Response(
+        content=pdf_bytes,
         media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=invoice_{invoice['number']}.pdf"}
+        headers={**headers, "Content-Disposition": f"attachment; filename=invoice_{invoice['number']}.pdf"}
     )
 
 
@@ -1555,32 +2630,18 @@ async def generate_invoice_pdf(invoice_id: str, current_user: User = Depends(get
 async def get_payments(
     current_user: User = Depends(get_current_user),
     page: int = 1,
-    page_size: int = 10
+    page_size: int = 10,
+    engine: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None
 ):
-    skip = (page - 1) * page_size
-    total = await db.payments.count_documents({})
-    
-    payments = await db.payments.find({}, {"_id": 0}).skip(skip).limit(page_size).to_list(page_size)
+    payments, meta = await fetch_page(db.payments, page, page_size, engine=engine, after=after, before=before, lookups=[CLIENT_NAME_LOOKUP])
     for payment in payments:
-        if isinstance(payment['created_at'], str):
-            payment['created_at'] = datetime.fromisoformat(payment['created_at'])
-        
-        # Populate client name
-        if payment.get('client_id'):
-            client = await db.clients.find_one({"id": payment['client_id']}, {"_id": 0, "name": 1})
-            if client:
-                payment['client_name'] = client['name']
-    
-    total_pages = (total + page_size - 1) // page_size
+        decode_dates(payment)
     
     return {
         "items": payments,
-        "meta": {
-            "total": total,
-            "page": page,
-            "page_size": page_size,
-            "total_pages": total_pages
-        }
+        "meta": meta
     }
 
 @api_router.post("/payments/intent", response_model=PaymentIntentResponse)
@@ -1595,7 +2656,7 @@ async def create_payment_intent(request: PaymentIntentRequest, current_user: Use
     
     # Create Stripe payment intent
     try:
-        intent = stripe.PaymentIntent.create(
+        intent = await stripe_gateway.create_payment_intent(
             amount=int(invoice['amount'] * 100),  # Stripe uses cents
             currency=invoice['currency'],
             metadata={
@@ -1605,10 +2666,14 @@ async def create_payment_intent(request: PaymentIntentRequest, current_user: Use
         )
         
         # Update invoice with payment intent ID
-        await db.invoices.update_one(
+        updated = await db.invoices.find_one_and_update(
             {"id": request.invoice_id},
-            {"$set": {"stripe_payment_intent_id": intent.id}}
+            {"$set": {"stripe_payment_intent_id": intent.id}, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
         )
+        if updated:
+            await publish_change("invoices", "update", updated, {"stripe_payment_intent_id": intent.id, "version": updated.get('version')})
         
         return PaymentIntentResponse(
             client_secret=intent.client_secret,
@@ -1621,7 +2686,7 @@ async def create_payment_intent(request: PaymentIntentRequest, current_user: Use
 async def get_stripe_transactions(current_user: User = Depends(get_current_user), limit: int = 50):
     """Get recent Stripe payment intents"""
     try:
-        payment_intents = stripe.PaymentIntent.list(limit=limit)
+        payment_intents = await stripe_gateway.list_payment_intents(limit=limit)
         
         transactions = []
         for intent in payment_intents.data:
@@ -1684,21 +2749,24 @@ async def stripe_webhook(request: dict):
         if invoice_id:
             # Update invoice status
             now = datetime.now(timezone.utc)
-            await db.invoices.update_one(
-                {"id": invoice_id},
-                {
-                    "$set": {
-                        "status": "paid",
-                        "paid_at": now.isoformat(),
-                        "updated_at": now.isoformat()
-                    }
-                }
+            changes = {
+                "status": "paid",
+                "paid_at": now,
+                "updated_at": now
+            }
+            # Only the first notification of a payment records it; Checkout also verifies it
+            invoice = await db.invoices.find_one_and_update(
+                {"id": invoice_id, "status": {"$ne": "paid"}},
+                {"$set": changes, "$inc": {"version": 1}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.BEFORE
             )
             
-            # Get invoice details
-            invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
-            
             if invoice:
+                paid = {**invoice, **changes, "version": (invoice.get('version') or 0) + 1}
+                await record_invoice_revenue(invoice, paid)
+                await publish_change("invoices", "update", paid, changed_fields(invoice, paid))
+                
                 # Create payment record
                 payment = Payment(
                     invoice_id=invoice_id,
@@ -1709,8 +2777,9 @@ async def stripe_webhook(request: dict):
                     stripe_payment_intent_id=payment_intent['id']
                 )
                 payment_dict = payment.model_dump()
-                payment_dict['created_at'] = payment_dict['created_at'].isoformat()
                 await db.payments.insert_one(payment_dict)
+                await publish_change("payments", "insert", payment_dict)
+                await record_payment(payment_dict)
                 
                 # Get client name
                 client = await db.clients.find_one({"id": invoice['client_id']}, {"_id": 0, "name": 1})
@@ -1724,17 +2793,7 @@ async def stripe_webhook(request: dict):
                     message=f"Invoice {invoice['number']} paid by {client_name} - ${payment_intent['amount'] / 100:,.2f}",
                     actor="Stripe Webhook"
                 )
-                activity_dict = activity.model_dump()
-                activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
-                await db.activity.insert_one(activity_dict)
-                
-                # Broadcast WebSocket update
-                await broadcast_update("invoice_paid", {
-                    "invoice_id": invoice_id,
-                    "invoice_number": invoice['number'],
-                    "amount": payment_intent['amount'] / 100,
-                    "client_name": client_name
-                })
+                await log_activity(activity)
                 
                 logger.info(f"Payment processed for invoice {invoice['number']}")
     
@@ -1746,22 +2805,25 @@ async def stripe_webhook(request: dict):
         if invoice_id:
             # Update invoice status
             now = datetime.now(timezone.utc)
-            await db.invoices.update_one(
-                {"id": invoice_id},
-                {
-                    "$set": {
-                        "status": "paid",
-                        "paid_at": now.isoformat(),
-                        "stripe_payment_intent_id": session.get('payment_intent'),
-                        "updated_at": now.isoformat()
-                    }
-                }
+            changes = {
+                "status": "paid",
+                "paid_at": now,
+                "stripe_payment_intent_id": session.get('payment_intent'),
+                "updated_at": now
+            }
+            # Only the first notification of a payment records it; Checkout also verifies it
+            invoice = await db.invoices.find_one_and_update(
+                {"id": invoice_id, "status": {"$ne": "paid"}},
+                {"$set": changes, "$inc": {"version": 1}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.BEFORE
             )
             
-            # Get invoice details
-            invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
-            
             if invoice:
+                paid = {**invoice, **changes, "version": (invoice.get('version') or 0) + 1}
+                await record_invoice_revenue(invoice, paid)
+                await publish_change("invoices", "update", paid, changed_fields(invoice, paid))
+                
                 # Create payment record
                 payment = Payment(
                     invoice_id=invoice_id,
@@ -1773,8 +2835,9 @@ async def stripe_webhook(request: dict):
                     stripe_charge_id=session.get('payment_intent')
                 )
                 payment_dict = payment.model_dump()
-                payment_dict['created_at'] = payment_dict['created_at'].isoformat()
                 await db.payments.insert_one(payment_dict)
+                await publish_change("payments", "insert", payment_dict)
+                await record_payment(payment_dict)
                 
                 # Get client name
                 client = await db.clients.find_one({"id": invoice['client_id']}, {"_id": 0, "name": 1})
@@ -1788,172 +2851,776 @@ async def stripe_webhook(request: dict):
                     message=f"Invoice {invoice['number']} paid by {client_name} via Stripe Checkout - €{session['amount_total'] / 100:,.2f}",
                     actor="Stripe Checkout"
                 )
-                activity_dict = activity.model_dump()
-                activity_dict['timestamp'] = activity_dict['timestamp'].isoformat()
-                await db.activity.insert_one(activity_dict)
+                await log_activity(activity)
                 
                 logger.info(f"Checkout session completed for invoice {invoice['number']}")
     
     return {"status": "success"}
 
 
-# ==================== METRICS ROUTES ====================
+# ==================== METRICS ROLLUPS ====================
+
+# Pre-aggregated dashboard figures, maintained by the write paths:
+#   {"_id": "counts"}: active_projects, total_clients
+#   {"kind": revenue|payments, "granularity": all|day|month, "period", "currency"}: amount, count
+ROLLUP_COUNTS_ID = "counts"
+# A startup rebuild claimed longer ago than this is assumed to have died with its worker
+ROLLUP_REBUILD_LOCK_SECONDS = int(os.environ.get('ROLLUP_REBUILD_LOCK_SECONDS', 600))
+
+# Paid amount of an invoice; legacy invoices stored it as `amount` instead of `total`
+INVOICE_AMOUNT = {"$ifNull": ["$total", {"$ifNull": ["$amount", 0]}]}
+
+# Invoice fields that decide what it contributes to revenue
+REVENUE_FIELDS = {"status", "paid_at", "line_items", "tva_rate"}
+REVENUE_PROJECTION = {"_id": 0, "status": 1, "paid_at": 1, "total": 1, "amount": 1, "currency": 1}
+
+def rollup_keys(kind: str, currency: str, at: Optional[datetime]) -> List[tuple]:
+    """(_id, fields) of the all-time, daily and monthly rollups of a currency that a date falls into"""
+    currency = currency.lower()
+    periods = [("all", None)]
+    if at is not None:
+        periods += [("day", truncate_date(at, "day")), ("month", truncate_date(at, "month"))]
+    return [
+        (
+            f"{kind}:{granularity}:{period.date() if period else 'all'}:{currency}",
+            {"kind": kind, "granularity": granularity, "period": period, "currency": currency}
+        )
+        for granularity, period in periods
+    ]
 
-@api_router.get("/metrics", response_model=Metrics)
-async def get_metrics(current_user: User = Depends(get_current_user)):
-    # Total revenue (sum of paid invoices) - handle both old (amount) and new (total) field names
-    paid_invoices = await db.invoices.find({"status": "paid"}, {"_id": 0, "amount": 1, "total": 1}).to_list(1000)
-    total_revenue = sum(inv.get('total', inv.get('amount', 0)) for inv in paid_invoices)
-    
-    # Active projects
-    active_projects = await db.projects.count_documents({"status": "active"})
+def rollup_updates(kind: str, currency: str, at: Optional[datetime], amount: float, count: int = 1) -> List[UpdateOne]:
+    """Upserts adding an amount to the all-time, daily and monthly rollups of a currency"""
+    return [
+        UpdateOne(
+            {"_id": rollup_id},
+            {"$inc": {"amount": amount, "count": count}, "$setOnInsert": fields},
+            upsert=True
+        )
+        for rollup_id, fields in rollup_keys(kind, currency, at)
+    ]
+
+def invoice_revenue_entry(invoice: Optional[dict]) -> Optional[tuple]:
+    """(currency, paid_at, amount) an invoice contributes to revenue, None when unpaid"""
+    if not invoice or invoice.get('status') != 'paid':
+        return None
+    amount = invoice.get('total')
+    if amount is None:
+        amount = invoice.get('amount') or 0
+    paid_at = parse_datetime(invoice['paid_at']) if invoice.get('paid_at') else None
+    return invoice.get('currency') or "eur", paid_at, amount
+
+async def record_invoice_revenue(before: Optional[dict], after: Optional[dict]):
+    """Move an invoice's revenue contribution from its previous state to its new one"""
+    removed, added = invoice_revenue_entry(before), invoice_revenue_entry(after)
+    if removed == added:
+        return
+    updates = []
+    if removed:
+        currency, paid_at, amount = removed
+        updates += rollup_updates("revenue", currency, paid_at, -amount, -1)
+    if added:
+        updates += rollup_updates("revenue", *added)
+    await db.metrics_rollups.bulk_write(updates)
+    await publish_change("metrics_rollups", "update", {"_id": "revenue"})
+
+async def record_payment(payment: dict):
+    """Add a newly stored payment to the payment rollups once it has succeeded"""
+    if payment.get('status') == "succeeded":
+        await db.metrics_rollups.bulk_write(
+            rollup_updates("payments", payment['currency'], payment['created_at'], payment['amount'])
+        )
+        await publish_change("metrics_rollups", "update", {"_id": "payments"})
+
+async def record_counts(**deltas: int):
+    """Adjust the active project and client counters"""
+    await db.metrics_rollups.update_one({"_id": ROLLUP_COUNTS_ID}, {"$inc": deltas}, upsert=True)
+    await publish_change("metrics_rollups", "update", {"_id": ROLLUP_COUNTS_ID})
+
+async def record_project_status(before: Optional[str], after: Optional[str]):
+    delta = (after == "active") - (before == "active")
+    if delta:
+        await record_counts(active_projects=delta)
+
+async def rebuild_metrics_rollups() -> dict:
+    """Recompute every rollup from scratch; writes made while it runs may need another rebuild
     
-    # Total clients
-    total_clients = await db.clients.count_documents({})
+    Rollups are written as absolute values, so rebuilds running at the same time agree
+    instead of adding up.
+    """
+    sources = [
+        ("revenue", db.invoices, {"status": "paid"}, "paid_at", INVOICE_AMOUNT, "eur"),
+        ("payments", db.payments, {"status": "succeeded"}, "created_at", "$amount", "usd"),
+    ]
+    totals = {}
+    for kind, collection, match, date_field, amount, default_currency in sources:
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {
+                    "currency": {"$toLower": {"$ifNull": ["$currency", default_currency]}},
+                    "day": {"$dateTrunc": {"date": f"${date_field}", "unit": "day", "timezone": "UTC"}}
+                },
+                "amount": {"$sum": amount},
+                "count": {"$sum": 1}
+            }}
+        ]
+        async for row in collection.aggregate(pipeline):
+            day = row['_id']['day'].replace(tzinfo=timezone.utc) if row['_id']['day'] else None
+            for rollup_id, fields in rollup_keys(kind, row['_id']['currency'], day):
+                rollup = totals.setdefault(rollup_id, {**fields, "amount": 0, "count": 0})
+                rollup['amount'] += row['amount']
+                rollup['count'] += row['count']
+    
+    active_projects, total_clients = await asyncio.gather(
+        db.projects.count_documents({"status": "active"}),
+        db.clients.count_documents({})
+    )
     
-    # MRR (simplified: total revenue / 12)
-    mrr = total_revenue / 12 if total_revenue > 0 else 0
+    if totals:
+        await db.metrics_rollups.bulk_write(
+            [ReplaceOne({"_id": rollup_id}, rollup, upsert=True) for rollup_id, rollup in totals.items()],
+            ordered=False
+        )
+    await db.metrics_rollups.delete_many({"_id": {"$nin": [ROLLUP_COUNTS_ID, *totals]}})
+    counts = {
+        "active_projects": active_projects,
+        "total_clients": total_clients,
+        "rebuilt_at": datetime.now(timezone.utc)
+    }
+    await db.metrics_rollups.replace_one({"_id": ROLLUP_COUNTS_ID}, counts, upsert=True)
     
+    rollups = await db.metrics_rollups.count_documents({"kind": {"$exists": True}})
+    for change in DASHBOARD_CHANGES:
+        await publish_change("metrics_rollups", "update", {"_id": change})
+    logger.info(f"Rebuilt {rollups} metrics rollups")
+    return {"rollups": rollups, "active_projects": active_projects, "total_clients": total_clients}
+
+
+# ==================== METRICS ROUTES ====================
+
+# MRR is the revenue collected over this many trailing days, today included
+MRR_WINDOW_DAYS = 30
+
+def rollup_query(kind: str, granularity: str, currency: Optional[str] = None, since: Optional[datetime] = None) -> dict:
+    """Filter selecting one kind of rollup at a granularity"""
+    query = {"kind": kind, "granularity": granularity}
+    if currency:
+        query['currency'] = currency.lower()
+    if since:
+        query['period'] = {"$gte": since}
+    return query
+
+async def load_metrics(currency: Optional[str] = None) -> Metrics:
+    """Dashboard figures from the rollups"""
+    since = truncate_date(datetime.now(timezone.utc) - timedelta(days=MRR_WINDOW_DAYS - 1), "day")
+    
+    # Counts, all-time revenue and the MRR window are a handful of rollup documents
+    rollups = await db.metrics_rollups.find({"$or": [
+        {"_id": ROLLUP_COUNTS_ID},
+        rollup_query("revenue", "all", currency),
+        rollup_query("revenue", "day", currency, since)
+    ]}).to_list(None)
+    
+    counts = next((doc for doc in rollups if doc['_id'] == ROLLUP_COUNTS_ID), {})
     return Metrics(
-        total_revenue=total_revenue,
-        active_projects=active_projects,
-        total_clients=total_clients,
-        mrr=mrr
+        total_revenue=sum(doc['amount'] for doc in rollups if doc.get('granularity') == "all"),
+        active_projects=counts.get('active_projects', 0),
+        total_clients=counts.get('total_clients', 0),
+        mrr=sum(doc['amount'] for doc in rollups if doc.get('granularity') == "day")
     )
 
+@api_router.get("/metrics", response_model=Metrics)
+async def get_metrics(current_user: User = Depends(get_current_user), currency: Optional[str] = None):
+    return await load_metrics(currency)
+
+@api_router.post("/metrics/rebuild")
+async def rebuild_metrics(current_user: User = Depends(get_current_user)):
+    """Recompute the metrics rollups from invoices, payments, projects and clients"""
+    return await rebuild_metrics_rollups()
+
 
 # ==================== ACTIVITY ROUTES ====================
 
 @api_router.get("/activity", response_model=List[Activity])
 async def get_activity(current_user: User = Depends(get_current_user), limit: int = 20):
+    return await load_activity(limit)
+
+async def load_activity(limit: int) -> List[dict]:
+    """Most recent activity entries, newest first"""
     activities = await db.activity.find({}, {"_id": 0}).sort("timestamp", -1).to_list(limit)
     for activity in activities:
-        if isinstance(activity['timestamp'], str):
-            activity['timestamp'] = datetime.fromisoformat(activity['timestamp'])
+        decode_dates(activity)
     return activities
 
+async def log_activity(activity: Activity):
+    """Store an activity entry; the event bus pushes it to connected dashboards"""
+    activity_dict = activity.model_dump()
+    await db.activity.insert_one(activity_dict)
+    await publish_change("activity", "insert", activity_dict)
+
 
 # ==================== CHART DATA ROUTES ====================
 
-@api_router.get("/charts/revenue")
-async def get_revenue_chart_data(current_user: User = Depends(get_current_user)):
-    """Get monthly revenue data for bar chart"""
-    # Simplified: return last 6 months with mock data
-    # In production, aggregate from database
-    now = datetime.now(timezone.utc)
-    months = []
-    for i in range(5, -1, -1):
-        month_date = now - timedelta(days=30 * i)
-        month_name = month_date.strftime("%b")
-        
-        # Get revenue for this month (simplified query)
-        start_date = month_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if i == 0:
-            end_date = now
-        else:
-            end_date = start_date + timedelta(days=32)
-            end_date = end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        invoices = await db.invoices.find({
-            "status": "paid",
-            "paid_at": {
-                "$gte": start_date.isoformat(),
-                "$lt": end_date.isoformat()
-            }
-        }, {"_id": 0, "amount": 1}).to_list(1000)
-        
-        revenue = sum(inv['amount'] for inv in invoices) if invoices else 0
-        
-        months.append({
-            "month": month_name,
-            "revenue": revenue
-        })
+CHART_GRANULARITIES = ("day", "week", "month")
+CHART_MAX_MONTHS = int(os.environ.get('CHART_MAX_MONTHS', 60))
+
+def add_months(date: datetime, months: int) -> datetime:
+    """Shift a first-of-month date by a number of calendar months"""
+    month_index = date.year * 12 + date.month - 1 + months
+    return date.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+def truncate_date(date: datetime, granularity: str) -> datetime:
+    """Start of the UTC day, ISO week (Monday) or calendar month containing date"""
+    date = date.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":
+        return date - timedelta(days=date.weekday())
+    if granularity == "month":
+        return date.replace(day=1)
+    return date
+
+def chart_buckets(months: int, granularity: str) -> List[datetime]:
+    """Bucket start dates covering the current month and the months before it"""
+    if granularity not in CHART_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity must be 'day', 'week' or 'month'")
+    if not 1 <= months <= CHART_MAX_MONTHS:
+        raise HTTPException(status_code=400, detail=f"months must be between 1 and {CHART_MAX_MONTHS}")
     
-    return months
+    now = datetime.now(timezone.utc)
+    bucket = truncate_date(add_months(truncate_date(now, "month"), 1 - months), granularity)
+    buckets = []
+    while bucket <= now:
+        buckets.append(bucket)
+        bucket = add_months(bucket, 1) if granularity == "month" else bucket + timedelta(days=7 if granularity == "week" else 1)
+    return buckets
+
+def bucket_label(bucket: datetime, granularity: str, span_years: bool) -> str:
+    if granularity == "month":
+        return bucket.strftime("%b %Y" if span_years else "%b")
+    return bucket.strftime("%d %b %Y" if span_years else "%d %b")
+
+async def chart_series(kind: str, months: int, granularity: str, key: str, currency: Optional[str] = None) -> List[dict]:
+    """Sum rollups per calendar bucket, zero-filling empty buckets"""
+    buckets = chart_buckets(months, granularity)
+    # Weeks are summed from daily rollups
+    source = "month" if granularity == "month" else "day"
+    
+    totals = {}
+    async for row in db.metrics_rollups.find(rollup_query(kind, source, currency, buckets[0]), {"_id": 0, "period": 1, "amount": 1}):
+        bucket = truncate_date(row['period'], granularity)
+        totals[bucket] = totals.get(bucket, 0) + row['amount']
+    
+    span_years = buckets[0].year != buckets[-1].year
+    return [
+        {
+            "month": bucket_label(bucket, granularity, span_years),
+            "period": bucket,
+            key: totals.get(bucket, 0)
+        }
+        for bucket in buckets
+    ]
+
+@api_router.get("/charts/revenue")
+async def get_revenue_chart_data(
+    current_user: User = Depends(get_current_user),
+    months: int = 6,
+    granularity: str = "month",
+    currency: Optional[str] = None
+):
+    """Get paid invoice revenue per period for bar chart"""
+    return await chart_series("revenue", months, granularity, "revenue", currency)
 
 @api_router.get("/charts/payments")
-async def get_payments_chart_data(current_user: User = Depends(get_current_user)):
-    """Get monthly payment data for line chart"""
-    # Similar to revenue chart
-    now = datetime.now(timezone.utc)
-    months = []
-    for i in range(5, -1, -1):
-        month_date = now - timedelta(days=30 * i)
-        month_name = month_date.strftime("%b")
-        
-        start_date = month_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if i == 0:
-            end_date = now
-        else:
-            end_date = start_date + timedelta(days=32)
-            end_date = end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        payments = await db.payments.find({
-            "status": "succeeded",
-            "created_at": {
-                "$gte": start_date.isoformat(),
-                "$lt": end_date.isoformat()
-            }
-        }, {"_id": 0, "amount": 1}).to_list(1000)
-        
-        amount = sum(p['amount'] for p in payments) if payments else 0
-        
-        months.append({
-            "month": month_name,
-            "amount": amount
-        })
-    
-    return months
+async def get_payments_chart_data(
+    current_user: User = Depends(get_current_user),
+    months: int = 6,
+    granularity: str = "month",
+    currency: Optional[str] = None
+):
+    """Get succeeded payment amounts per period for line chart"""
+    return await chart_series("payments", months, granularity, "amount", currency)
 
 
 # ==================== WEBSOCKET FOR REAL-TIME UPDATES ====================
 
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Set
-import json
+from fastapi.encoders import jsonable_encoder
+from typing import Set, Dict
+
+# Outbound messages buffered per connection before the slow-consumer policy applies
+WS_QUEUE_SIZE = int(os.environ.get('WS_QUEUE_SIZE', 256))
+# "drop_oldest" discards the oldest queued message, "disconnect" closes the socket
+WS_SLOW_CONSUMER_POLICY = os.environ.get('WS_SLOW_CONSUMER_POLICY', 'drop_oldest')
+
+class WebSocketConnection:
+    """A client socket with its own bounded outbound queue, drained by a writer task"""
+    
+    def __init__(self, websocket: WebSocket, user_id: Optional[str], max_queue: int = WS_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY):
+        self.id = str(uuid.uuid4())
+        self.websocket = websocket
+        self.user_id = user_id
+        self.policy = policy
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self.connected_at = datetime.now(timezone.utc)
+        self.topics: Set[str] = set()
+        # Broadcasts held back while a snapshot is built, and the snapshot drop_oldest must keep
+        self.held: Optional[List[str]] = None
+        self.pinned: Optional[str] = None
+        self.writer = asyncio.create_task(self._write())
+    
+    @property
+    def authenticated(self) -> bool:
+        return self.user_id is not None
+    
+    def subscribe(self, topic: str) -> bool:
+        """Start receiving a topic; False when already subscribed"""
+        if topic in self.topics:
+            return False
+        self.topics.add(topic)
+        topic_subscribers.setdefault(topic, set()).add(self)
+        return True
+    
+    def unsubscribe(self, topic: str):
+        if topic in self.topics:
+            self.topics.discard(topic)
+            self._drop_subscriber(topic)
+    
+    def _drop_subscriber(self, topic: str):
+        subscribers = topic_subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del topic_subscribers[topic]
+    
+    def _leave(self):
+        """Stop receiving broadcasts of any kind"""
+        active_connections.discard(self)
+        for topic in self.topics:
+            self._drop_subscriber(topic)
+    
+    def send(self, message: str):
+        """Queue a message without waiting on the socket"""
+        if self.closed:
+            return
+        if self.held is not None:
+            if len(self.held) >= self.queue.maxsize:
+                if self.policy == "disconnect":
+                    logger.warning(f"Disconnecting slow WebSocket client {self.id}")
+                    self.close(status.WS_1013_TRY_AGAIN_LATER)
+                    return
+                self.held.pop(0)
+                self.dropped += 1
+            self.held.append(message)
+            return
+        if self.queue.full():
+            if self.policy == "disconnect":
+                logger.warning(f"Disconnecting slow WebSocket client {self.id}")
+                self.close(status.WS_1013_TRY_AGAIN_LATER)
+                return
+            self.dropped += 1
+            if not self._evict_oldest():
+                return
+        self.queue.put_nowait(message)
+    
+    def _evict_oldest(self) -> bool:
+        """Make room by dropping the oldest queued message other than the pinned snapshot"""
+        messages = [self.queue.get_nowait() for _ in range(self.queue.qsize())]
+        index = next((i for i, message in enumerate(messages) if message is not self.pinned), None)
+        if index is not None:
+            del messages[index]
+        for message in messages:
+            self.queue.put_nowait(message)
+        return index is not None
+    
+    def hold(self):
+        """Buffer broadcasts until release(), so a snapshot can go out ahead of them"""
+        if self.held is None:
+            self.held = []
+    
+    def release(self, snapshot: Optional[str] = None):
+        """Queue the snapshot, which drop_oldest will not evict, then the held broadcasts"""
+        held, self.held = self.held or [], None
+        if snapshot is not None:
+            self.pinned = snapshot
+            self.send(snapshot)
+        for message in held:
+            self.send(message)
+    
+    async def _write(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send_text(message)
+                self.sent += 1
+                if message is self.pinned:
+                    self.pinned = None
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The client went away; the receive loop notices and cleans up
+            pass
+        finally:
+            self.closed = True
+            self._leave()
+    
+    def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        if self.closed:
+            return
+        self.closed = True
+        self._leave()
+        self.writer.cancel()
+        asyncio.create_task(self._close_socket(code))
+    
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+    
+    def stats(self) -> dict:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "connected_at": self.connected_at,
+            "topics": sorted(self.topics),
+            "queue_depth": self.queue.qsize(),
+            "max_queue": self.queue.maxsize,
+            "sent": self.sent,
+            "dropped": self.dropped
+        }
 
-# Store active WebSocket connections
-active_connections: Set[WebSocket] = set()
+# Store active WebSocket connections, and the ones subscribed to each topic
+active_connections: Set[WebSocketConnection] = set()
+topic_subscribers: Dict[str, Set[WebSocketConnection]] = {}
+
+# Topics are "dashboard", "activity", "invoice:{id}" and "project:{id}"
+WS_TOPICS = ("dashboard", "activity")
+WS_ENTITY_TOPICS = ("invoice", "project")
+# Anonymous sockets may watch one invoice, like the public invoice page
+WS_PUBLIC_TOPICS = ("invoice",)
+# Authenticated sockets that do not ask for topics get the dashboard feed
+WS_DEFAULT_TOPICS = ("dashboard", "activity")
+WS_MAX_TOPICS = int(os.environ.get('WS_MAX_TOPICS', 64))
+
+def topic_error(topic: str, authenticated: bool) -> Optional[str]:
+    """Why a socket may not subscribe to a topic, None when it may"""
+    kind, _, entity_id = topic.partition(":")
+    if topic in WS_TOPICS:
+        return None if authenticated else "authentication required"
+    if kind in WS_ENTITY_TOPICS and entity_id:
+        return None if authenticated or kind in WS_PUBLIC_TOPICS else "authentication required"
+    return "unknown topic"
+
+# Rollup changes made within this window are pushed as a single metrics message
+DASHBOARD_PUSH_DELAY_SECONDS = float(os.environ.get('DASHBOARD_PUSH_DELAY_SECONDS', 0.25))
+DASHBOARD_ACTIVITY_LIMIT = 10
+DASHBOARD_CHANGES = ("counts", "revenue", "payments")
+
+# Rollups changed since the last metrics push
+dashboard_changes: Set[str] = set()
+dashboard_push: Optional[asyncio.Task] = None
+
+def encode_message(update_type: str, data, topics=()) -> str:
+    message = {
+        "type": update_type,
+        "data": jsonable_encoder(data),
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+    if topics:
+        message['topics'] = list(topics)
+    return json.dumps(message)
+
+async def dashboard_snapshot() -> dict:
+    """Everything the dashboard renders, sent once when a client connects"""
+    metrics, revenue, payments, activity = await asyncio.gather(
+        load_metrics(),
+        chart_series("revenue", 6, "month", "revenue"),
+        chart_series("payments", 6, "month", "amount"),
+        load_activity(DASHBOARD_ACTIVITY_LIMIT)
+    )
+    return {"metrics": metrics, "revenue": revenue, "payments": payments, "activity": activity}
+
+def notify_dashboard(*changes: str):
+    """Schedule a metrics push for changed rollups, coalescing bursts of writes"""
+    global dashboard_push
+    dashboard_changes.update(changes)
+    if dashboard_push is None or dashboard_push.done():
+        dashboard_push = asyncio.create_task(push_dashboard())
+
+async def push_dashboard():
+    """Send fresh metrics, and the charts to refetch, once the burst of changes settles"""
+    while dashboard_changes:
+        await asyncio.sleep(DASHBOARD_PUSH_DELAY_SECONDS)
+        changes = set(dashboard_changes)
+        dashboard_changes.clear()
+        if not topic_subscribers.get("dashboard"):
+            continue
+        try:
+            metrics = await load_metrics()
+        except Exception as e:
+            logger.error(f"Failed to load dashboard metrics: {e}")
+            continue
+        await broadcast_update("metrics", {
+            "metrics": metrics,
+            "charts": sorted(changes & {"revenue", "payments"})
+        }, ["dashboard"])
+
+async def update_subscriptions(connection: WebSocketConnection, action: str, topics):
+    """Apply a subscribe or unsubscribe request and confirm the resulting topics"""
+    if not isinstance(topics, list):
+        topics = []
+    added = []
+    rejected = {}
+    for topic in map(str, topics):
+        if action == "unsubscribe":
+            connection.unsubscribe(topic)
+            continue
+        error = topic_error(topic, connection.authenticated)
+        if error is None and topic not in connection.topics and len(connection.topics) >= WS_MAX_TOPICS:
+            error = "too many topics"
+        if error:
+            rejected[topic] = error
+        elif connection.subscribe(topic):
+            added.append(topic)
+    
+    connection.send(encode_message("subscribed", {"topics": sorted(connection.topics), "rejected": rejected}))
+    # Subscribed before the snapshot is built so no change slips between the two;
+    # changes broadcast meanwhile are held and queued behind the snapshot
+    if "dashboard" in added:
+        connection.hold()
+        snapshot = None
+        try:
+            snapshot = encode_message("snapshot", await dashboard_snapshot(), ["dashboard"])
+        finally:
+            connection.release(snapshot)
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time updates"""
+@api_router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = None, topics: Optional[str] = None):
+    """WebSocket endpoint for real-time updates
+    
+    The JWT is passed as ?token= and the initial topics as ?topics=a,b. Clients change
+    topics with {"type": "subscribe"|"unsubscribe", "topics": [...]}; any other message
+    is a heartbeat. Without a token only invoice topics are available.
+    """
+    user = None
+    if token:
+        try:
+            user = await resolve_user(token)
+        except HTTPException:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+    
     await websocket.accept()
-    active_connections.add(websocket)
+    connection = WebSocketConnection(websocket, user.id if user else None)
+    active_connections.add(connection)
     
     try:
+        initial_topics = topics.split(",") if topics else list(WS_DEFAULT_TOPICS if user else ())
+        await update_subscriptions(connection, "subscribe", initial_topics)
         while True:
             # Keep connection alive and listen for messages
             data = await websocket.receive_text()
+            try:
+                message = json.loads(data)
+            except ValueError:
+                message = None
             
-            # Echo back for heartbeat
-            await websocket.send_text(json.dumps({"type": "pong"}))
+            if isinstance(message, dict) and message.get('type') in ("subscribe", "unsubscribe"):
+                await update_subscriptions(connection, message['type'], message.get('topics'))
+            else:
+                # Echo back for heartbeat
+                connection.send(json.dumps({"type": "pong"}))
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
         logger.info("WebSocket client disconnected")
-
-async def broadcast_update(update_type: str, data: dict):
-    """Broadcast updates to all connected WebSocket clients"""
-    if not active_connections:
+    finally:
+        connection.close()
+
+async def broadcast_update(update_type: str, data, topics):
+    """Send an update to the sockets subscribed to any of its topics; never waits on a socket"""
+    recipients = set()
+    for topic in topics:
+        recipients |= topic_subscribers.get(topic, set())
+    if not recipients:
         return
     
-    message = json.dumps({
-        "type": update_type,
-        "data": data,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    })
+    message = encode_message(update_type, data, topics)
+    for connection in recipients:
+        connection.send(message)
+
+@api_router.get("/system/websockets")
+async def get_websocket_stats(current_user: User = Depends(get_current_user)):
+    """Outbound queue depth of every open WebSocket connection"""
+    connections = [connection.stats() for connection in active_connections]
+    return {
+        "connections": len(connections),
+        "topics": len(topic_subscribers),
+        "queued": sum(c['queue_depth'] for c in connections),
+        "dropped": sum(c['dropped'] for c in connections),
+        "policy": WS_SLOW_CONSUMER_POLICY,
+        "event_bus": event_bus.stats(),
+        "items": sorted(connections, key=lambda c: c['queue_depth'], reverse=True)
+    }
+
+
+# ==================== EVENT BUS ====================
+
+# "change_streams" tails MongoDB so every worker sees every write, "local" only
+# delivers this worker's own writes, "auto" uses change streams when available
+EVENT_BUS = os.environ.get('EVENT_BUS', 'auto')
+EVENT_BUS_RETRY_SECONDS = float(os.environ.get('EVENT_BUS_RETRY_SECONDS', 5))
+# InvalidResumeToken, ChangeStreamFatalError and ChangeStreamHistoryLost: the saved token
+# can never be resumed, so the stream restarts from now
+CHANGE_STREAM_UNRESUMABLE_CODES = (260, 280, 286)
+
+class EventBus:
+    """Feeds this worker's broadcaster with data changes, shaped like change stream events"""
     
-    # Send to all connected clients
-    disconnected = set()
-    for connection in active_connections:
-        try:
-            await connection.send_text(message)
-        except:
-            disconnected.add(connection)
+    COLLECTIONS = ("activity", "invoices", "payments", "metrics_rollups")
+    # Deletes only carry the document's _id unless the collection records pre-images
+    PRE_IMAGE_COLLECTIONS = ("invoices",)
+    
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.streaming = False
+        self.available = False
+        self.resume_token = None
+        self.delivered = 0
+        self.task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        if self.mode != "local":
+            self.task = asyncio.create_task(self._watch())
+    
+    def stop(self):
+        if self.task:
+            self.task.cancel()
     
-    # Remove disconnected clients
-    for conn in disconnected:
-        active_connections.discard(conn)
+    async def publish(self, change: dict):
+        """Local stand-in for the change stream; a running stream already delivers every write"""
+        if not self.streaming:
+            await self.deliver(change)
+    
+    async def deliver(self, change: dict):
+        self.delivered += 1
+        try:
+            await dispatch_change(change)
+        except Exception as e:
+            logger.error(f"Failed to dispatch {change['operationType']} on {change['ns']['coll']}: {e}")
+    
+    async def _enable_pre_images(self):
+        for collection_name in self.PRE_IMAGE_COLLECTIONS:
+            try:
+                await db.command("collMod", collection_name, changeStreamPreAndPostImages={"enabled": True})
+            except Exception as e:
+                logger.info(f"Change stream pre-images unavailable on {collection_name}: {e}")
+    
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self.COLLECTIONS)}}}]
+        await self._enable_pre_images()
+        while True:
+            try:
+                async with db.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    full_document_before_change="whenAvailable",
+                    resume_after=self.resume_token
+                ) as stream:
+                    # The first fetch fails when the deployment has no change streams
+                    change = await stream.try_next()
+                    if not self.streaming:
+                        logger.info("Event bus is tailing MongoDB change streams")
+                    self.streaming = self.available = True
+                    while True:
+                        if change is not None:
+                            self.resume_token = stream.resume_token
+                            await self.deliver(change)
+                        change = await stream.next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.mode == "auto" and not self.available:
+                    logger.info(f"Change streams unavailable ({e}), delivering events in-process only")
+                    return
+                if isinstance(e, OperationFailure) and e.code in CHANGE_STREAM_UNRESUMABLE_CODES:
+                    logger.warning(f"Change stream cannot resume, restarting from now; events in between are lost: {e}")
+                    self.resume_token = None
+                # Deliver this worker's own writes until the stream resumes
+                self.streaming = False
+                logger.error(f"Change stream interrupted, retrying in {EVENT_BUS_RETRY_SECONDS}s: {e}")
+                await asyncio.sleep(EVENT_BUS_RETRY_SECONDS)
+    
+    def stats(self) -> dict:
+        return {"mode": self.mode, "streaming": self.streaming, "delivered": self.delivered}
+
+event_bus = EventBus(EVENT_BUS)
+
+def changed_fields(previous: dict, document: dict) -> dict:
+    """Fields whose value differs from the pre-image, like a change stream's updatedFields"""
+    return {field: value for field, value in document.items() if previous.get(field) != value}
+
+async def publish_change(collection: str, operation: str, document: dict, updated_fields: Optional[dict] = None):
+    """Hand a write to the event bus in the shape of a change stream event; deletes pass the removed document"""
+    await event_bus.publish({
+        "ns": {"coll": collection},
+        "operationType": operation,
+        "documentKey": {"_id": document.get('_id')},
+        "fullDocument": None if operation == "delete" else document,
+        "fullDocumentBeforeChange": document if operation == "delete" else None,
+        "updateDescription": {"updatedFields": updated_fields or {}}
+    })
+
+async def dispatch_change(change: dict):
+    """Turn one data change into the WebSocket messages it implies"""
+    collection = change['ns']['coll']
+    operation = change['operationType']
+    # Deletes only carry the removed document as a pre-image
+    source = change.get('fullDocumentBeforeChange') if operation == "delete" else change.get('fullDocument')
+    document = {k: v for k, v in (source or {}).items() if k != '_id'}
+    updated_fields = (change.get('updateDescription') or {}).get('updatedFields') or {}
+    
+    if collection == "metrics_rollups":
+        key = change['documentKey']['_id']
+        notify_dashboard(key.split(":")[0])
+    
+    elif collection == "activity" and operation == "insert":
+        topics = ["activity"]
+        if document.get('entity_type') in WS_ENTITY_TOPICS:
+            topics.append(f"{document['entity_type']}:{document.get('entity_id')}")
+        await broadcast_update("activity", decode_dates(document), topics)
+    
+    elif collection == "invoices" and document:
+        decode_dates(document)
+        topics = [f"invoice:{document.get('id')}"]
+        if document.get('project_id'):
+            topics.append(f"project:{document['project_id']}")
+        if operation == "delete":
+            await broadcast_update("invoice_deleted", {"id": document.get('id')}, topics)
+            return
+        await broadcast_update("invoice_updated", {
+            field: document.get(field)
+            for field in ("id", "number", "status", "total", "currency", "paid_at", "version", "client_id", "project_id")
+        }, topics)
+        became_paid = updated_fields.get('status') == "paid" or (operation == "insert" and document.get('status') == "paid")
+        if became_paid:
+            client_names = await load_client_names([document.get('client_id')])
+            entry = invoice_revenue_entry(document)
+            await broadcast_update("invoice_paid", {
+                "invoice_id": document.get('id'),
+                "invoice_number": document.get('number'),
+                "amount": entry[2] if entry else 0,
+                "client_name": client_names.get(document.get('client_id'), "Unknown Client")
+            }, [*topics, "dashboard"])
+    
+    elif collection == "payments" and operation == "insert" and document.get('status') == "succeeded":
+        topics = ["dashboard"]
+        if document.get('invoice_id'):
+            topics.append(f"invoice:{document['invoice_id']}")
+        await broadcast_update("payment_received", {
+            field: document.get(field)
+            for field in ("id", "invoice_id", "client_id", "amount", "currency", "created_at")
+        }, topics)
 
 
 # Include the router in the main app
@@ -1976,4 +3643,11 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    event_bus.stop()
+    client.close()
+    for connection in list(active_connections):
+        connection.close(status.WS_1001_GOING_AWAY)
+    for task in list(thumbnail_jobs.values()):
+        task.cancel()
+    for pool in worker_pools.values():
+        pool.shutdown()
\ No newline at end of file
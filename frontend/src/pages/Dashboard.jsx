@@ -6,6 +6,12 @@ import { DollarSign, FolderKanban, Users2, TrendingUp, BarChart3, TrendingUpIcon
 import api from '../lib/api';
 import { motion } from 'framer-motion';
 
+const WS_URL = process.env.REACT_APP_BACKEND_URL.replace(/^http/, 'ws');
+const ACTIVITY_LIMIT = 10;
+const RECONNECT_MIN_DELAY_MS = 1000;
+const RECONNECT_MAX_DELAY_MS = 30000;
+const SNAPSHOT_TIMEOUT_MS = 5000;
+
 const StatCard = ({ title, value, icon: Icon, trend, loading }) => (
   <motion.div
     initial={{ opacity: 0, y: 8 }}
@@ -46,33 +52,102 @@ export default function Dashboard() {
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    fetchDashboardData();
-    
-    // Set up polling for real-time updates every 15 seconds
-    const intervalId = setInterval(() => {
-      fetchDashboardData();
-    }, 15000);
-    
-    // Cleanup interval on unmount
-    return () => clearInterval(intervalId);
+    // Live updates are pushed over the WebSocket; nothing is polled
+    let socket;
+    let reconnectTimer;
+    let snapshotTimer;
+    let reconnectDelay = RECONNECT_MIN_DELAY_MS;
+    let closed = false;
+
+    const connect = () => {
+      const token = localStorage.getItem('token');
+      socket = new WebSocket(`${WS_URL}/api/ws?token=${encodeURIComponent(token || '')}&topics=dashboard,activity`);
+      let synced = false;
+      let fellBack = false;
+
+      // A socket that opens but never delivers the snapshot (e.g. a proxy holding
+      // the upgrade) would leave the dashboard empty; show the REST data meanwhile
+      const fallBack = () => {
+        if (synced || fellBack) return;
+        fellBack = true;
+        fetchDashboardData();
+      };
+      snapshotTimer = setTimeout(fallBack, SNAPSHOT_TIMEOUT_MS);
+
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'snapshot') {
+          synced = true;
+          clearTimeout(snapshotTimer);
+          reconnectDelay = RECONNECT_MIN_DELAY_MS;
+          applySnapshot(message.data);
+        } else if (message.type === 'metrics') {
+          setMetrics(message.data.metrics);
+          message.data.charts.forEach(fetchChart);
+        } else if (message.type === 'activity') {
+          setActivities((current) => [message.data, ...current.filter((a) => a.id !== message.data.id)].slice(0, ACTIVITY_LIMIT));
+        }
+      };
+
+      socket.onclose = () => {
+        if (closed) return;
+        clearTimeout(snapshotTimer);
+        // The snapshot on reconnect brings the dashboard back in sync;
+        // until then, show what the REST API returns
+        fallBack();
+        reconnectTimer = setTimeout(connect, reconnectDelay);
+        reconnectDelay = Math.min(reconnectDelay * 2, RECONNECT_MAX_DELAY_MS);
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
+      clearTimeout(snapshotTimer);
+      socket?.close();
+    };
   }, []);
 
+  const applySnapshot = (snapshot) => {
+    setMetrics(snapshot.metrics);
+    setRevenueData(snapshot.revenue);
+    setPaymentsData(snapshot.payments);
+    setActivities(snapshot.activity);
+    setLoading(false);
+  };
+
+  const fetchChart = async (chart) => {
+    try {
+      const response = await api.get(`/charts/${chart}`);
+      if (chart === 'revenue') {
+        setRevenueData(response.data);
+      } else {
+        setPaymentsData(response.data);
+      }
+    } catch (error) {
+      console.error(`Failed to fetch ${chart} chart:`, error);
+    }
+  };
+
   const fetchDashboardData = async () => {
     try {
       const [metricsRes, revenueRes, paymentsRes, activityRes] = await Promise.all([
         api.get('/metrics'),
         api.get('/charts/revenue'),
         api.get('/charts/payments'),
-        api.get('/activity?limit=10')
+        api.get(`/activity?limit=${ACTIVITY_LIMIT}`)
       ]);
 
-      setMetrics(metricsRes.data);
-      setRevenueData(revenueRes.data);
-      setPaymentsData(paymentsRes.data);
-      setActivities(activityRes.data);
+      applySnapshot({
+        metrics: metricsRes.data,
+        revenue: revenueRes.data,
+        payments: paymentsRes.data,
+        activity: activityRes.data
+      });
     } catch (error) {
       console.error('Failed to fetch dashboard data:', error);
-    } finally {
       setLoading(false);
     }
   };
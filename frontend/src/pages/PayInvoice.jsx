@@ -9,6 +9,7 @@ import { toast } from 'sonner';
 import { motion } from 'framer-motion';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
+const WS_URL = API_URL.replace(/^http/, 'ws');
 
 export default function PayInvoice() {
   const { invoice_id } = useParams();
@@ -33,6 +34,18 @@ export default function PayInvoice() {
     fetchInvoice();
   }, [fetchInvoice]);
 
+  useEffect(() => {
+    // Refresh when this invoice changes, e.g. once the payment is confirmed
+    const socket = new WebSocket(`${WS_URL}/api/ws?topics=${encodeURIComponent(`invoice:${invoice_id}`)}`);
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === 'invoice_updated' || message.type === 'invoice_deleted') {
+        fetchInvoice();
+      }
+    };
+    return () => socket.close();
+  }, [invoice_id, fetchInvoice]);
+
   const handlePayNow = async () => {
     // Check if invoice is already paid (refresh data first)
     await fetchInvoice();
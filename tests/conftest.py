@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py reads its configuration from the environment at import time
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_unused")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
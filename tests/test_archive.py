@@ -0,0 +1,68 @@
+import asyncio
+import io
+import zipfile
+
+import pytest
+
+server = pytest.importorskip("server", reason="backend dependencies are not installed")
+
+
+def build_entries(tmp_path, files):
+    entries, used = [], set()
+    for index, (filename, size) in enumerate(files):
+        path = tmp_path / f"blob-{index}"
+        path.write_bytes(bytes(i % 251 for i in range(size)))
+        stat_result = path.stat()
+        entries.append((server.unique_arcname(filename, used), path, size, stat_result.st_mtime))
+    return entries
+
+
+def stream(entries) -> bytes:
+    async def collect():
+        return b"".join([chunk async for chunk in server.iter_zip(entries)])
+    return asyncio.run(collect())
+
+
+def test_stored_zip_size_matches_streamed_bytes(tmp_path, monkeypatch):
+    # Small chunks exercise the drain between writes
+    monkeypatch.setattr(server, "DOWNLOAD_CHUNK_SIZE", 1000)
+    entries = build_entries(tmp_path, [
+        ("brief.pdf", 12345),
+        ("empty.txt", 0),
+        ("brief.pdf", 70000),
+        ("maquette-été.png", 3),
+    ])
+
+    data = stream(entries)
+
+    assert server.stored_zip_size(entries) == len(data)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ["brief.pdf", "empty.txt", "brief (2).pdf", "maquette-été.png"]
+
+
+def test_stored_zip_size_of_empty_archive():
+    assert server.stored_zip_size([]) == len(stream([]))
+
+
+def test_stored_zip_size_refuses_zip64():
+    entries = [("huge.bin", None, zipfile.ZIP64_LIMIT, 0)]
+    assert server.stored_zip_size(entries) is None
+
+
+@pytest.mark.parametrize("filename, expected", [
+    ("../../etc/passwd", "passwd"),
+    ("/absolute/report.pdf", "report.pdf"),
+    ("..\\..\\windows\\win.ini", "win.ini"),
+    ("C:report.pdf", "C_report.pdf"),
+    ("..", "file"),
+    ("dir/", "file"),
+])
+def test_unique_arcname_strips_paths(filename, expected):
+    assert server.unique_arcname(filename, set()) == expected
+
+
+def test_unique_arcname_numbers_duplicates():
+    used = set()
+    names = [server.unique_arcname(name, used) for name in ("a.txt", "x/a.txt", "a.txt")]
+    assert names == ["a.txt", "a (2).txt", "a (3).txt"]
@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+
+import pytest
+
+server = pytest.importorskip("server", reason="backend dependencies are not installed")
+from fastapi import HTTPException
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2025, 3, 14, 9, 26, 53, 589000, tzinfo=timezone.utc)
+    cursor = server.encode_cursor({"created_at": created_at, "id": "c0ffee"})
+
+    assert "=" not in cursor
+    assert server.decode_cursor(cursor) == (created_at, "c0ffee")
+
+
+def test_cursor_accepts_legacy_string_dates():
+    cursor = server.encode_cursor({"created_at": "2025-03-14T09:26:53", "id": "c0ffee"})
+
+    created_at, doc_id = server.decode_cursor(cursor)
+    assert created_at == datetime(2025, 3, 14, 9, 26, 53, tzinfo=timezone.utc)
+    assert doc_id == "c0ffee"
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", "e30", "bnVsbA"])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        server.decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_keyset_match_orders_by_created_at_then_id():
+    created_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    cursor = server.encode_cursor({"created_at": created_at, "id": "b"})
+
+    assert server.keyset_match(cursor, after=True) == {"$or": [
+        {"created_at": {"$gt": created_at}},
+        {"created_at": created_at, "id": {"$gt": "b"}},
+    ]}
+    assert server.keyset_match(cursor, after=False)["$or"][1]["id"] == {"$lt": "b"}
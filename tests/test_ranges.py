@@ -0,0 +1,35 @@
+import pytest
+
+server = pytest.importorskip("server", reason="backend dependencies are not installed")
+from fastapi import HTTPException
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    ("bytes=999-999", (999, 999)),
+    ("BYTES = 0-0", (0, 0)),
+])
+def test_parse_byte_range(header, expected):
+    assert server.parse_byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-10",
+    "bytes=0-10,20-30",
+    "bytes=abc-",
+    "bytes=-",
+])
+def test_parse_byte_range_falls_back_to_full_file(header):
+    assert server.parse_byte_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=500-100"])
+def test_parse_byte_range_unsatisfiable(header):
+    with pytest.raises(HTTPException) as error:
+        server.parse_byte_range(header, 1000)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */1000"